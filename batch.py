@@ -0,0 +1,96 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+from pipeline import load_pipeline, run_pipeline
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# pipeline steps of the worker process, set by initializer so they are not sent with every image
+_steps = None
+
+
+def _init_worker(steps):
+    global _steps
+    _steps = steps
+    # workers run in parallel, so opencv should not start its own threads in each of them
+    cv2.setNumThreads(1)
+
+
+def _process_image(input_path, output_path):
+    start = time.perf_counter()
+    image = cv2.imread(input_path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f'Could not read {input_path}')
+    read_time = time.perf_counter()
+    result, is_grayscale = run_pipeline(image, _steps)
+    process_time = time.perf_counter()
+    if not cv2.imwrite(output_path, result):
+        raise ValueError(f'Could not write {output_path}')
+    write_time = time.perf_counter()
+    return image.shape[0] * image.shape[1], read_time - start, process_time - read_time, write_time - process_time
+
+
+def list_images(directory):
+    return sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def run_batch(steps, input_dir, output_dir, workers=None, extension=None):
+    os.makedirs(output_dir, exist_ok=True)
+    names = list_images(input_dir)
+    results = {}
+    errors = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(steps,)) as executor:
+        futures = {}
+        for name in names:
+            output_name = name if extension is None else os.path.splitext(name)[0] + extension
+            future = executor.submit(_process_image, os.path.join(input_dir, name),
+                                     os.path.join(output_dir, output_name))
+            futures[future] = name
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                pixels, read_time, process_time, write_time = future.result()
+            except Exception as error:
+                errors[name] = str(error)
+                print(f'{name}: error: {error}')
+                continue
+            results[name] = (pixels, read_time, process_time, write_time)
+            total = read_time + process_time + write_time
+            print(f'{name}: {total * 1000:.1f} ms (read {read_time * 1000:.1f} ms, process {process_time * 1000:.1f} '
+                  f'ms, write {write_time * 1000:.1f} ms), {pixels / total / 1e6:.1f} MP/s')
+    return results, errors, time.perf_counter() - start
+
+
+def print_summary(results, errors, elapsed, workers):
+    print()
+    print(f'Processed {len(results)} images ({len(errors)} errors) in {elapsed:.2f} s using {workers} workers')
+    if not results:
+        return
+    pixels = sum(result[0] for result in results.values())
+    stage_totals = [sum(result[i] for result in results.values()) for i in range(1, 4)]
+    print(f'Throughput: {len(results) / elapsed:.2f} images/s, {pixels / elapsed / 1e6:.1f} MP/s')
+    print(f'Mean per image: read {stage_totals[0] / len(results) * 1000:.1f} ms, '
+          f'process {stage_totals[1] / len(results) * 1000:.1f} ms, '
+          f'write {stage_totals[2] / len(results) * 1000:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply pipeline recorded in Image tester to every image in directory')
+    parser.add_argument('pipeline', help='pipeline file exported from the application (File > Export Pipeline)')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-e', '--extension', default=None,
+                        help='extension of output files, e.g. .png (default: the same as input)')
+    args = parser.parse_args()
+
+    steps = load_pipeline(args.pipeline)
+    results, errors, elapsed = run_batch(steps, args.input_dir, args.output_dir, args.workers, args.extension)
+    print_summary(results, errors, elapsed, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import operations
+from display import PpmEncoder, to_pil_image
+from pyramid import Pyramid
+
+DEFAULT_SIZES = ['640x480', '1920x1080', '4000x3000']
+DEFAULT_CHANNELS = [1, 3]
+DEFAULT_THRESHOLD = 0.2
+
+# representative parameters of every operation
+BENCHMARK_PARAMETERS = {
+    'rotate_by_90': {},
+    'rotate_by_180': {},
+    'rotate_by_270': {},
+    'to_grayscale': {},
+    'median_blur': {'ksize': 5},
+    'gaussian_blur': {'ksize_x': 5, 'ksize_y': 5},
+    'averaging_blur': {'ksize_x': 5, 'ksize_y': 5},
+    'bilateral_filter': {'ksize': 9, 'sigma': 75.0},
+    'global_threshold': {'maxval': 255, 'threshold': 150},
+    'mean_threshold': {'maxval': 255, 'block_size': 11, 'c': 10},
+    'gaussian_threshold': {'maxval': 255, 'block_size': 11, 'c': 10},
+    'sobel': {'delta': 0, 'ksize': 3, 'dx': 1, 'dy': 1},
+    'sobel_x': {'delta': 0, 'ksize': 3},
+    'sobel_y': {'delta': 0, 'ksize': 3},
+    'laplacian': {'delta': 0, 'ksize': 3},
+    'canny': {'threshold1': 50, 'threshold2': 150, 'l2_gradient': False},
+}
+
+
+def synthetic_image(width, height, channels, seed=0):
+    # smooth gradients with noise and some edges, so filters and thresholds do realistic amount of work
+    random = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = (x * 255 / max(width - 1, 1) + y * 255 / max(height - 1, 1)) / 2
+    base[(x // 64 + y // 64) % 2 == 0] *= 0.5
+    planes = [np.clip(base + random.normal(0, 20, base.shape), 0, 255) for _ in range(channels)]
+    return np.dstack(planes).astype(np.uint8) if channels > 1 else planes[0].astype(np.uint8)
+
+
+def measure(function, repeats, warmup=1):
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    # peak memory is measured in separate run, because tracing slows execution down
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'median_ms': float(np.median(times) * 1000),
+        'p95_ms': float(np.percentile(times, 95) * 1000),
+        'peak_mb': peak / 2 ** 20,
+    }
+
+
+def encode_from_pyramid(encoder, pyramid, is_grayscale, scale):
+    level, level_scale = pyramid.level(scale)
+    return encoder.encode(level, is_grayscale, level_scale)
+
+
+def benchmark_cases(names, sizes, channels_list):
+    for size in sizes:
+        width, height = (int(value) for value in size.split('x'))
+        for channels in channels_list:
+            image = synthetic_image(width, height, channels)
+            is_grayscale = channels == 1
+            for name in names:
+                operation = operations.OPERATIONS[name]
+                if not operation.validate(is_grayscale)[0]:
+                    continue
+                parameters = BENCHMARK_PARAMETERS[name]
+                yield f'{name}@{width}x{height}x{channels}', lambda o=operation, p=parameters, i=image: o(i, **p)
+
+            # display conversion as done by ImageManager.image_to_tk, PhotoImage is measured only with display
+            yield f'display@{width}x{height}x{channels}', lambda i=image, g=is_grayscale: to_pil_image(i, g, 100)
+            yield f'display_scaled@{width}x{height}x{channels}', lambda i=image, g=is_grayscale: to_pil_image(i, g, 50)
+            # display conversion of PPM backend
+            encoder = PpmEncoder()
+            yield f'display_ppm@{width}x{height}x{channels}', \
+                lambda e=encoder, i=image, g=is_grayscale: e.encode(i, g, 100)
+            yield f'display_ppm_scaled@{width}x{height}x{channels}', \
+                lambda e=encoder, i=image, g=is_grayscale: e.encode(i, g, 50)
+            # zoom at 25% resampled from already built pyramid level
+            pyramid = Pyramid(image)
+            pyramid.level(25)
+            yield f'display_ppm_pyramid@{width}x{height}x{channels}', \
+                lambda e=encoder, p=pyramid, g=is_grayscale: encode_from_pyramid(e, p, g, 25)
+
+
+def photo_image_cases(sizes):
+    try:
+        from tkinter import Tk
+        from PIL import ImageTk
+        root = Tk()
+        root.withdraw()
+    except Exception:
+        return
+    for size in sizes:
+        width, height = (int(value) for value in size.split('x'))
+        image = synthetic_image(width, height, 3)
+        pil_image = to_pil_image(image, False)
+        yield f'photo_image@{width}x{height}x3', lambda i=pil_image: ImageTk.PhotoImage(i)
+        ppm_image = PpmEncoder().encode(image, False)
+        photo = ppm_image.photo_image()
+        yield f'photo_image_ppm@{width}x{height}x3', lambda i=ppm_image, p=photo: i.paste(p)
+    root.destroy()
+
+
+def run(names, sizes, channels_list, repeats):
+    results = {}
+    for case, function in benchmark_cases(names, sizes, channels_list):
+        results[case] = measure(function, repeats)
+        print(f'{case}: median {results[case]["median_ms"]:.2f} ms, p95 {results[case]["p95_ms"]:.2f} ms, '
+              f'peak {results[case]["peak_mb"]:.1f} MB')
+    for case, function in photo_image_cases(sizes):
+        results[case] = measure(function, repeats)
+        print(f'{case}: median {results[case]["median_ms"]:.2f} ms, p95 {results[case]["p95_ms"]:.2f} ms, '
+              f'peak {results[case]["peak_mb"]:.1f} MB')
+    return results
+
+
+def compare(results, baseline, threshold):
+    # returns list of (case, baseline median, current median) slower than baseline by more than threshold
+    regressions = []
+    for case, values in results.items():
+        if case in baseline:
+            if values['median_ms'] > baseline[case]['median_ms'] * (1 + threshold):
+                regressions.append((case, baseline[case]['median_ms'], values['median_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ImageManager operations and display conversion')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    parser.add_argument('-b', '--baseline', help='json file with results of previous run to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown of median treated as regression (default: 0.2)')
+    parser.add_argument('-r', '--repeats', type=int, default=10)
+    parser.add_argument('--operations', nargs='+', default=list(BENCHMARK_PARAMETERS),
+                        choices=list(BENCHMARK_PARAMETERS))
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='image sizes as WIDTHxHEIGHT')
+    parser.add_argument('--channels', nargs='+', type=int, default=DEFAULT_CHANNELS, choices=[1, 3])
+    args = parser.parse_args()
+
+    results = run(args.operations, args.sizes, args.channels, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'meta': {'python': platform.python_version(), 'opencv': cv2.__version__,
+                                'numpy': np.__version__, 'machine': platform.machine(),
+                                'repeats': args.repeats},
+                       'results': results}, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        print()
+        if regressions:
+            for case, baseline_median, median in regressions:
+                print(f'REGRESSION {case}: {baseline_median:.2f} ms -> {median:.2f} ms '
+                      f'(+{(median / baseline_median - 1) * 100:.0f}%)')
+            sys.exit(1)
+        print(f'No regressions (threshold {args.threshold * 100:.0f}%)')
+
+
+if __name__ == '__main__':
+    main()
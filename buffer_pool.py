@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+
+DEFAULT_MAX_FREE_BYTES = 512 * 1024 * 1024
+
+
+class BufferPool:
+    # Reusable arrays keyed by (shape, dtype). Acquired array belongs to the caller until it is released, so arrays
+    # which are still displayed are never overwritten; arrays which are never released are simply garbage collected.
+    def __init__(self, max_free_bytes=DEFAULT_MAX_FREE_BYTES):
+        self.__max_free_bytes = max_free_bytes
+        self.__free = {}
+        self.__free_bytes = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def free_bytes(self):
+        return self.__free_bytes
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self.__lock:
+            free = self.__free.get(key)
+            if free:
+                array = free.pop()
+                self.__free_bytes -= array.nbytes
+                return array
+        return np.empty(shape, dtype)
+
+    def release(self, array):
+        if array is None:
+            return
+        key = (array.shape, array.dtype.str)
+        with self.__lock:
+            if self.__free_bytes + array.nbytes > self.__max_free_bytes:
+                return
+            self.__free.setdefault(key, []).append(array)
+            self.__free_bytes += array.nbytes
+
+    def clear(self):
+        with self.__lock:
+            self.__free.clear()
+            self.__free_bytes = 0
+
+
+class NoPool:
+    # used when operation is called without a pool, every call allocates new arrays
+    @staticmethod
+    def acquire(shape, dtype=np.uint8):
+        return np.empty(shape, dtype)
+
+    @staticmethod
+    def release(array):
+        pass
+
+
+NO_POOL = NoPool()
@@ -0,0 +1,123 @@
+import math
+from tkinter import PhotoImage
+import cv2
+import numpy as np
+from PIL import Image
+from profiling import profiler
+
+# scaled images bigger than this (in pixels) are displayed in tiles
+DEFAULT_TILED_THRESHOLD = 8 * 1024 * 1024
+TILE_SIZE = 512
+
+# PIL_BACKEND converts images through PIL, PPM_BACKEND passes them to Tk as PPM/PGM data decoded natively by Tk
+PIL_BACKEND = 'pil'
+PPM_BACKEND = 'ppm'
+DEFAULT_BACKEND = PPM_BACKEND
+
+
+# scale is given in percents
+def scale_image(image, scale):
+    if scale != 100:
+        width = int(image.shape[1] * scale / 100)
+        height = int(image.shape[0] * scale / 100)
+        return cv2.resize(image, (width, height))
+    else:
+        return image
+
+
+def to_pil_image(cv_image, is_grayscale, scale=100):
+    image = cv_image
+    if not is_grayscale:
+        with profiler.stage('cvtColor'):
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with profiler.stage('scale'):
+        image = scale_image(image, scale)
+    with profiler.stage('fromarray'):
+        return Image.fromarray(image)
+
+
+class PpmImage:
+    # image encoded as binary PPM (color) or PGM (grayscale), it can be loaded into an existing Tk photo image
+    def __init__(self, data, width, height):
+        self.data = data
+        self.__width = width
+        self.__height = height
+
+    def width(self):
+        return self.__width
+
+    def height(self):
+        return self.__height
+
+    def paste(self, photo_image):
+        photo_image.configure(width=self.__width, height=self.__height, format='PPM', data=self.data)
+
+    def photo_image(self):
+        return PhotoImage(width=self.__width, height=self.__height, format='PPM', data=self.data)
+
+
+class PpmEncoder:
+    # Scaling and color swap write directly into one scratch buffer reused between calls (swap is done in place
+    # after scaling), so the only allocation per image is the bytes object passed to Tk.
+    def __init__(self):
+        self.__buffer = bytearray()
+
+    def encode(self, cv_image, is_grayscale, scale=100):
+        return self.encode_resized(cv_image, is_grayscale, max(int(cv_image.shape[1] * scale / 100), 1),
+                                   max(int(cv_image.shape[0] * scale / 100), 1))
+
+    def encode_resized(self, cv_image, is_grayscale, width, height):
+        header = f'{"P5" if is_grayscale else "P6"}\n{width} {height}\n255\n'.encode()
+        shape = (height, width) if is_grayscale else (height, width, 3)
+        size = len(header) + int(np.prod(shape))
+        if len(self.__buffer) < size:
+            self.__buffer = bytearray(size)
+        self.__buffer[:len(header)] = header
+        pixels = np.frombuffer(self.__buffer, np.uint8, int(np.prod(shape)), len(header)).reshape(shape)
+
+        if (width, height) != (cv_image.shape[1], cv_image.shape[0]):
+            with profiler.stage('scale'):
+                cv2.resize(cv_image, (width, height), dst=pixels)
+            source = pixels
+        else:
+            source = cv_image
+        if is_grayscale:
+            if source is not pixels:
+                np.copyto(pixels, source)
+        else:
+            with profiler.stage('cvtColor'):
+                cv2.cvtColor(source, cv2.COLOR_BGR2RGB, dst=pixels)
+        return PpmImage(bytes(memoryview(self.__buffer)[:size]), width, height)
+
+
+class TileSource:
+    # Image displayed piece by piece. Only requested regions are converted and scaled, so the cost of displaying
+    # depends on the size of the window instead of the size of the image.
+    def __init__(self, cv_image, is_grayscale, scale):
+        self.__image = cv_image
+        self.__is_grayscale = is_grayscale
+        self.__scale = scale / 100
+        self.__width = max(int(cv_image.shape[1] * self.__scale), 1)
+        self.__height = max(int(cv_image.shape[0] * self.__scale), 1)
+        self.__encoder = PpmEncoder()
+
+    def width(self):
+        return self.__width
+
+    def height(self):
+        return self.__height
+
+    def render(self, x0, y0, x1, y1):
+        with profiler.stage('render tile'):
+            return self.__render(x0, y0, x1, y1)
+
+    def __render(self, x0, y0, x1, y1):
+        # coordinates of the region are given in displayed (scaled) image
+        x1 = min(x1, self.__width)
+        y1 = min(y1, self.__height)
+        source_x0 = int(x0 / self.__scale)
+        source_y0 = int(y0 / self.__scale)
+        source_x1 = min(max(math.ceil(x1 / self.__scale), source_x0 + 1), self.__image.shape[1])
+        source_y1 = min(max(math.ceil(y1 / self.__scale), source_y0 + 1), self.__image.shape[0])
+        tile = self.__image[source_y0:source_y1, source_x0:source_x1]
+        return self.__encoder.encode_resized(tile, self.__is_grayscale, x1 - x0, y1 - y0).photo_image()
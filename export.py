@@ -0,0 +1,84 @@
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+import cv2
+
+DEFAULT_PNG_COMPRESSION = 3
+DEFAULT_JPEG_QUALITY = 95
+# number of images per worker which may wait for encoding at once
+PENDING_PER_WORKER = 2
+
+
+def encoder_parameters(path, png_compression=DEFAULT_PNG_COMPRESSION, jpeg_quality=DEFAULT_JPEG_QUALITY):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    if extension in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+    return []
+
+
+def write_image(path, image, parameters):
+    if not cv2.imwrite(path, image, parameters):
+        raise IOError(f'Could not write {path}')
+
+
+def export_file_name(index, description, extension):
+    # e.g. 003_Median_blur_ksize=5.png
+    name = re.sub(r'[^\w=.-]+', '_', description).strip('_')
+    return f'{index:03d}_{name}{extension}'
+
+
+class ExportJob:
+    # Writes images on a pool of threads. Items are (path, load) pairs, load returns the image and is called on the
+    # thread calling pump (images may come from history which is not thread safe). Only a few images per worker wait
+    # for encoding at once, so memory use does not depend on the number of exported images.
+    def __init__(self, executor, workers, items, png_compression=DEFAULT_PNG_COMPRESSION,
+                 jpeg_quality=DEFAULT_JPEG_QUALITY):
+        self.__executor = executor
+        self.__items = list(items)
+        self.__next = 0
+        self.__pending = []
+        self.__max_pending = workers * PENDING_PER_WORKER
+        self.__png_compression = png_compression
+        self.__jpeg_quality = jpeg_quality
+        self.__done = 0
+        self.__start = time.perf_counter()
+        self.duration = None
+        # list of (path, exception)
+        self.errors = []
+
+    @property
+    def progress(self):
+        return self.__done, len(self.__items)
+
+    @property
+    def finished(self):
+        return self.duration is not None
+
+    def pump(self):
+        # collects finished writes and submits next images, returns True when everything is written
+        for path, future in [entry for entry in self.__pending if entry[1].done()]:
+            self.__pending.remove((path, future))
+            self.__done += 1
+            if future.exception() is not None:
+                self.errors.append((path, future.exception()))
+        while len(self.__pending) < self.__max_pending and self.__next < len(self.__items):
+            path, load = self.__items[self.__next]
+            self.__next += 1
+            try:
+                image = load()
+            except Exception as error:
+                self.errors.append((path, error))
+                self.__done += 1
+                continue
+            parameters = encoder_parameters(path, self.__png_compression, self.__jpeg_quality)
+            self.__pending.append((path, self.__executor.submit(write_image, path, image, parameters)))
+        if not self.__pending and self.__next == len(self.__items) and self.duration is None:
+            self.duration = time.perf_counter() - self.__start
+        return self.finished
+
+    def wait(self):
+        while not self.pump():
+            wait([future for _, future in self.__pending], return_when=FIRST_COMPLETED)
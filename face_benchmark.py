@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+import face_detection
+from batch import list_images
+from pipeline import load_pipeline, run_pipeline
+
+# minimal intersection over union of detected and ground truth box to count face as found
+IOU_THRESHOLD = 0.5
+
+# state of the worker process set by initializer
+_steps = None
+_haar_configurations = None
+_haar_cascade = None
+_dlib_models = None
+
+
+def _init_worker(steps, haar_configurations, use_dlib):
+    global _steps, _haar_configurations, _haar_cascade, _dlib_models
+    cv2.setNumThreads(1)
+    _steps = steps
+    _haar_configurations = haar_configurations
+    if haar_configurations:
+        _haar_cascade = face_detection.load_haar_cascade()
+    if use_dlib:
+        _dlib_models = face_detection.load_face_detector(), face_detection.load_shape_predictor()
+
+
+def _benchmark_image(path):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f'Could not read {path}')
+    image, is_grayscale = run_pipeline(image, _steps)
+    if not is_grayscale:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # detector name -> (latency in seconds, list of (x, y, w, h) boxes)
+    results = {}
+    for scale_factor, min_neighbours, working_scale in _haar_configurations:
+        start = time.perf_counter()
+        faces = face_detection.haar_detect(_haar_cascade, image, scale_factor, min_neighbours, working_scale)
+        latency = time.perf_counter() - start
+        boxes = [tuple(int(v) for v in face) for face in faces]
+        results[haar_name(scale_factor, min_neighbours, working_scale)] = (latency, boxes)
+    if _dlib_models is not None:
+        start = time.perf_counter()
+        boxes, _ = face_detection.dlib_detect(_dlib_models[0], _dlib_models[1], image)
+        results['dlib'] = (time.perf_counter() - start, [tuple(box) for box in boxes.tolist()])
+    return results
+
+
+def haar_name(scale_factor, min_neighbours, working_scale=100):
+    return f'haar scale_factor={scale_factor} min_neighbours={min_neighbours} working_scale={working_scale}'
+
+
+def iou(box_a, box_b):
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    width = min(ax + aw, bx + bw) - max(ax, bx)
+    height = min(ay + ah, by + bh) - max(ay, by)
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / (aw * ah + bw * bh - intersection)
+
+
+def match_faces(detected, ground_truth):
+    # greedy matching, returns number of ground truth faces found
+    unmatched = list(ground_truth)
+    found = 0
+    for box in detected:
+        best = max(unmatched, key=lambda truth: iou(box, truth), default=None)
+        if best is not None and iou(box, best) >= IOU_THRESHOLD:
+            unmatched.remove(best)
+            found += 1
+    return found
+
+
+def run_benchmark(image_dir, steps, haar_configurations, use_dlib, workers=None):
+    names = list_images(image_dir)
+    # image name -> detector name -> (latency, boxes)
+    results = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(steps, haar_configurations, use_dlib)) as executor:
+        futures = {executor.submit(_benchmark_image, os.path.join(image_dir, name)): name for name in names}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                print(f'{futures[future]}: error: {error}')
+    return results, time.perf_counter() - start
+
+
+def summarize(results, ground_truth=None):
+    detectors = sorted({detector for image_results in results.values() for detector in image_results})
+    summary = {}
+    for detector in detectors:
+        latencies = np.array([results[name][detector][0] for name in results])
+        detections = sum(len(results[name][detector][1]) for name in results)
+        detector_summary = {
+            'images': len(latencies),
+            'detections': detections,
+            'detections_per_image': detections / len(latencies),
+            'latency_p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'latency_p90_ms': float(np.percentile(latencies, 90) * 1000),
+            'latency_p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'images_per_second_per_worker': float(len(latencies) / latencies.sum()),
+        }
+        if ground_truth is not None:
+            faces = sum(len(ground_truth.get(name, [])) for name in results)
+            found = sum(match_faces(results[name][detector][1], ground_truth.get(name, [])) for name in results)
+            detector_summary['recall'] = found / faces if faces else None
+            detector_summary['precision'] = found / detections if detections else None
+        summary[detector] = detector_summary
+    return summary
+
+
+def print_summary(summary, elapsed, images, workers):
+    print(f'Benchmarked {images} images in {elapsed:.2f} s using {workers} workers ({images / elapsed:.2f} images/s)')
+    for detector, values in summary.items():
+        print()
+        print(detector)
+        for key, value in values.items():
+            print(f'    {key}: {value:.3f}' if isinstance(value, float) else f'    {key}: {value}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark speed and accuracy of face detectors after preprocessing')
+    parser.add_argument('image_dir')
+    parser.add_argument('-p', '--pipeline', help='preprocessing pipeline file (File > Export Pipeline)')
+    parser.add_argument('-g', '--ground-truth', help='json file mapping image names to lists of [x, y, w, h] boxes')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--scale-factor', type=float, nargs='+', default=[1.1], help='haar cascade scale factors')
+    parser.add_argument('--min-neighbours', type=int, nargs='+', default=[10], help='haar cascade min neighbours')
+    parser.add_argument('--working-scale', type=int, nargs='+', default=[100],
+                        help='resolutions (in percents) haar cascade is run at')
+    parser.add_argument('--no-haar', action='store_true', help='do not run haar cascade')
+    parser.add_argument('--no-dlib', action='store_true', help='do not run dlib detector')
+    parser.add_argument('-o', '--output', help='write summary as json to this file')
+    args = parser.parse_args()
+
+    steps = load_pipeline(args.pipeline) if args.pipeline else []
+    ground_truth = None
+    if args.ground_truth:
+        with open(args.ground_truth) as file:
+            ground_truth = json.load(file)
+    haar_configurations = [] if args.no_haar else [(scale_factor, min_neighbours, working_scale)
+                                                   for scale_factor in args.scale_factor
+                                                   for working_scale in args.working_scale
+                                                   for min_neighbours in args.min_neighbours]
+
+    results, elapsed = run_benchmark(args.image_dir, steps, haar_configurations, not args.no_dlib, args.workers)
+    summary = summarize(results, ground_truth)
+    print_summary(summary, elapsed, len(results), args.workers)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(summary, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import cv2
+import numpy as np
+
+HAAR_CASCADE_PATH = './FaceDetectionAssets/haarcascade_frontalface_default.xml'
+SHAPE_PREDICTOR_PATH = './FaceDetectionAssets/shape_predictor_68_face_landmarks.dat'
+
+# landmarks of 68 points shape predictor drawn in separate colors
+LANDMARK_COUNT = 68
+FACE_LANDMARKS = slice(0, 36)
+EYE_LANDMARKS = slice(36, 48)
+MOUTH_LANDMARKS = slice(48, 68)
+
+# states of ModelLoader
+NOT_LOADED = 'not loaded'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def load_haar_cascade(path=HAAR_CASCADE_PATH):
+    cascade = cv2.CascadeClassifier(path)
+    if cascade.empty():
+        raise IOError(f'Could not load haar cascade from {path}')
+    return cascade
+
+
+# dlib is imported only when its models are needed, importing it takes noticeable time
+def load_shape_predictor(path=SHAPE_PREDICTOR_PATH):
+    import dlib
+    return dlib.shape_predictor(path)
+
+
+def load_face_detector():
+    import dlib
+    return dlib.get_frontal_face_detector()
+
+
+def load_dlib_models(path=SHAPE_PREDICTOR_PATH):
+    return load_face_detector(), load_shape_predictor(path)
+
+
+class ModelLoader:
+    # Loads a model on a background thread when it is requested for the first time, so starting the application
+    # does not depend on the size of models that may never be used.
+    def __init__(self, load):
+        self.__load = load
+        self.__lock = threading.Lock()
+        self.__state = NOT_LOADED
+        self.__model = None
+        self.error = None
+
+    @property
+    def state(self):
+        return self.__state
+
+    @property
+    def model(self):
+        # None until the model is ready
+        return self.__model
+
+    def preload(self):
+        with self.__lock:
+            if self.__state != NOT_LOADED:
+                return
+            self.__state = LOADING
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def __run(self):
+        try:
+            model = self.__load()
+        except Exception as error:
+            self.error = error
+            self.__state = FAILED
+        else:
+            self.__model = model
+            self.__state = READY
+
+
+# Returns array of (x, y, w, h) boxes in coordinates of the given image. Detection can be run on a downscaled image
+# (working scale in percents, time drops with its square) and restricted to a region (x, y, w, h). Face sizes are
+# given in pixels of the original image, 0 means no limit.
+def haar_detect(cascade, gray_image, scale_factor, min_neighbours, working_scale=100, min_size=0, max_size=0,
+                region=None):
+    offset_x, offset_y = 0, 0
+    if region is not None:
+        x, y, w, h = region
+        offset_x, offset_y = max(x, 0), max(y, 0)
+        gray_image = gray_image[offset_y:max(y + h, 0), offset_x:max(x + w, 0)]
+        if gray_image.size == 0:
+            return np.empty((0, 4), dtype=int)
+
+    factor = min(working_scale, 100) / 100
+    if factor < 1:
+        gray_image = cv2.resize(gray_image, (max(int(gray_image.shape[1] * factor), 1),
+                                             max(int(gray_image.shape[0] * factor), 1)),
+                                interpolation=cv2.INTER_AREA)
+    sizes = {}
+    if min_size > 0:
+        sizes['minSize'] = (max(int(min_size * factor), 1),) * 2
+    if max_size > 0:
+        sizes['maxSize'] = (max(int(max_size * factor), 1),) * 2
+
+    faces = cascade.detectMultiScale(gray_image, scaleFactor=scale_factor, minNeighbors=min_neighbours, **sizes)
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=int)
+    faces = np.round(np.asarray(faces) / factor).astype(int)
+    faces[:, 0] += offset_x
+    faces[:, 1] += offset_y
+    return faces
+
+
+# Returns (boxes, landmarks): int arrays (N, 4) of (x, y, w, h) boxes and (N, 68, 2) of (x, y) landmark points.
+# Points are converted from dlib once, so they can be drawn and saved without touching dlib objects again.
+def dlib_detect(detector, shape_predictor, gray_image):
+    faces = detector(gray_image)
+    if len(faces) == 0:
+        return np.empty((0, 4), dtype=int), np.empty((0, LANDMARK_COUNT, 2), dtype=int)
+    boxes = np.array([dlib_box(face) for face in faces], dtype=int)
+    landmarks = np.array([[(point.x, point.y) for point in shape_predictor(gray_image, face).parts()]
+                          for face in faces], dtype=int)
+    return boxes, landmarks
+
+
+def image_digest(image):
+    # identifies pixels of an image, so detections can be reused for the same input
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16)
+    digest.update(repr((image.shape, image.dtype.str)).encode())
+    return digest.hexdigest()
+
+
+def dlib_box(face):
+    return face.left(), face.top(), face.right() - face.left(), face.bottom() - face.top()
+
+
+def disc_offsets(radius):
+    # (dx, dy) of pixels of a filled circle exactly as drawn by cv2.circle
+    stamp = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+    cv2.circle(stamp, (radius, radius), radius, 1, -1)
+    dy, dx = np.nonzero(stamp)
+    return np.stack([dx - radius, dy - radius], axis=1)
+
+
+def draw_points(image, points, radius, color):
+    # draws filled circles at all points of (..., 2) array at once, pixels are the same as of cv2.circle
+    pixels = (points.reshape(-1, 1, 2) + disc_offsets(max(radius, 0))).reshape(-1, 2)
+    inside = ((pixels[:, 0] >= 0) & (pixels[:, 0] < image.shape[1]) &
+              (pixels[:, 1] >= 0) & (pixels[:, 1] < image.shape[0]))
+    pixels = pixels[inside]
+    image[pixels[:, 1], pixels[:, 0]] = color if image.ndim == 3 else color[0]
+
+
+def draw_haar_faces(image, faces, thickness=2, color=(0, 255, 0)):
+    for (x, y, w, h) in faces:
+        cv2.rectangle(image, (int(x), int(y)), (int(x + w), int(y + h)), color, thickness=thickness)
+
+
+def draw_dlib_faces(image, boxes, landmarks, eye_color=(0, 255, 0), mouth_color=(255, 0, 0), face_color=(0, 0, 255),
+                    frame_color=(0, 255, 255), thickness=2):
+    # faces are drawn one after another, so overlapping faces are layered in order of detection
+    for box, points in zip(boxes, landmarks):
+        draw_haar_faces(image, box[np.newaxis], thickness, frame_color)
+        draw_points(image, points[FACE_LANDMARKS], thickness, face_color)
+        draw_points(image, points[EYE_LANDMARKS], thickness, eye_color)
+        draw_points(image, points[MOUTH_LANDMARKS], thickness, mouth_color)
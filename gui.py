@@ -1,3 +1,5 @@
+import re
+import time
 from tkinter import *
 from tkinter import ttk, messagebox
 from tkinter import filedialog as fd
@@ -6,15 +8,29 @@ from PIL import Image
 from PIL import ImageTk
 import cv2
 from image_manager import ImageManager
-from parameters_gui import CannyMenu, MedianBlur, GeneralBlurMenu, BilateralFilterMenu, GlobalThresholdMenu, AdaptiveThresholdMenu, GradientMenu, HaarCascadeMenu, ShapePredictorMenu
+from display import TileSource, PpmImage, PpmEncoder, TILE_SIZE
+from video import DEFAULT_DISPLAY_FPS, format_statistics
+from histogram import histogram_lines, CHANNEL_COLORS, GRAY_COLOR
+from preview_worker import PreviewWorker
+import operations
+from profiling import profiler
+from face_detection import LOADING
+from export import DEFAULT_PNG_COMPRESSION, DEFAULT_JPEG_QUALITY
+from parameters_gui import CannyMenu, MedianBlur, GeneralBlurMenu, BilateralFilterMenu, GlobalThresholdMenu, AdaptiveThresholdMenu, GradientMenu, HaarCascadeMenu, ShapePredictorMenu, SweepDialog, ExportDialog
 
 
 class ScrollableImage(ttk.Frame):
     def __init__(self, master=None, **kw):
-        self.__image = kw.pop('image', None)
+        image = kw.pop('image', None)
         super(ScrollableImage, self).__init__(master=master, **kw)
         self.cnvs = Canvas(self, highlightthickness=0, **kw)
-        self.__shape = self.cnvs.create_image(0, 0, anchor='nw', image=self.__image)
+        self.__image = None
+        self.__shape = None
+        # PpmImages are loaded into this photo image, so its canvas item is reused
+        self.__photo = None
+        # tiled mode: (column, row) -> (canvas item, tile image) of tiles currently on the canvas
+        self.__tiles = {}
+        self.__tiles_update_pending = False
         self.v_scroll = ttk.Scrollbar(self, orient='vertical')
         self.h_scroll = ttk.Scrollbar(self, orient='horizontal')
         self.cnvs.grid(row=0, column=0, sticky='nsew')
@@ -22,11 +38,12 @@ class ScrollableImage(ttk.Frame):
         self.v_scroll.grid(row=0, column=1, sticky='ns')
         self.rowconfigure(0, weight=1)
         self.columnconfigure(0, weight=1)
-        self.cnvs.config(xscrollcommand=self.h_scroll.set,
-                         yscrollcommand=self.v_scroll.set)
+        self.cnvs.config(xscrollcommand=self.__scroll_wrapper(self.h_scroll),
+                         yscrollcommand=self.__scroll_wrapper(self.v_scroll))
         self.v_scroll.config(command=self.cnvs.yview)
         self.h_scroll.config(command=self.cnvs.xview)
-        self.cnvs.config(scrollregion=self.cnvs.bbox('all'))
+        self.cnvs.bind('<Configure>', self.__schedule_tiles_update)
+        self.image = image
 
     @property
     def image(self):
@@ -34,10 +51,59 @@ class ScrollableImage(ttk.Frame):
 
     @image.setter
     def image(self, new_image):
-        self.cnvs.delete(self.__shape)
-        self.__image = new_image
-        self.__shape = self.cnvs.create_image(0, 0, anchor='nw', image=self.__image)
-        self.cnvs.config(scrollregion=self.cnvs.bbox('all'))
+        with profiler.stage('canvas update'):
+            if not (isinstance(new_image, PpmImage) and isinstance(self.__image, PpmImage)):
+                self.cnvs.delete('image')
+                self.__tiles = {}
+                self.__shape = None
+            self.__image = new_image
+            if isinstance(new_image, TileSource):
+                self.cnvs.config(scrollregion=(0, 0, new_image.width(), new_image.height()))
+                self.__update_tiles()
+            elif isinstance(new_image, PpmImage):
+                if self.__photo is None:
+                    self.__photo = PhotoImage(master=self.cnvs)
+                new_image.paste(self.__photo)
+                if self.__shape is None:
+                    self.__shape = self.cnvs.create_image(0, 0, anchor='nw', image=self.__photo, tags='image')
+                self.cnvs.config(scrollregion=(0, 0, new_image.width(), new_image.height()))
+            else:
+                self.__shape = self.cnvs.create_image(0, 0, anchor='nw', image=self.__image, tags='image')
+                self.cnvs.config(scrollregion=self.cnvs.bbox('all'))
+
+    def __scroll_wrapper(self, scrollbar):
+        def wrapper(*args):
+            scrollbar.set(*args)
+            self.__schedule_tiles_update()
+        return wrapper
+
+    def __schedule_tiles_update(self, event=None):
+        if isinstance(self.__image, TileSource) and not self.__tiles_update_pending:
+            self.__tiles_update_pending = True
+            self.after_idle(self.__update_tiles)
+
+    def __update_tiles(self):
+        self.__tiles_update_pending = False
+        source = self.__image
+        if not isinstance(source, TileSource):
+            return
+        # visible region extended by prefetch margin
+        margin = TILE_SIZE // 2
+        x0 = max(int(self.cnvs.canvasx(0)) - margin, 0)
+        y0 = max(int(self.cnvs.canvasy(0)) - margin, 0)
+        x1 = min(int(self.cnvs.canvasx(self.cnvs.winfo_width())) + margin, source.width())
+        y1 = min(int(self.cnvs.canvasy(self.cnvs.winfo_height())) + margin, source.height())
+        visible = {(column, row)
+                   for column in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1)
+                   for row in range(y0 // TILE_SIZE, (y1 - 1) // TILE_SIZE + 1)}
+
+        for tile in [tile for tile in self.__tiles if tile not in visible]:
+            self.cnvs.delete(self.__tiles.pop(tile)[0])
+        for column, row in visible - self.__tiles.keys():
+            x, y = column * TILE_SIZE, row * TILE_SIZE
+            tile_image = source.render(x, y, x + TILE_SIZE, y + TILE_SIZE)
+            item = self.cnvs.create_image(x, y, anchor='nw', image=tile_image, tags='image')
+            self.__tiles[(column, row)] = (item, tile_image)
 
 
 class ScrollableList(ttk.Frame):
@@ -95,10 +161,165 @@ class ScrollableList(ttk.Frame):
         return self.__list_box.curselection()
 
 
+class ContactSheet(Toplevel):
+    # grid of labelled thumbnails filled as results of a sweep arrive, clicking a cell calls on_select with its index
+    POLL_INTERVAL = 50
+
+    def __init__(self, master, sweep, on_select, **kw):
+        super().__init__(master, **kw)
+        self.title('Parameter sweep')
+        self.__sweep = sweep
+        self.__on_select = on_select
+        self.__thumbnails = {}
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+
+        self.__canvas = Canvas(self, highlightthickness=0)
+        v_scroll = ttk.Scrollbar(self, orient='vertical', command=self.__canvas.yview)
+        h_scroll = ttk.Scrollbar(self, orient='horizontal', command=self.__canvas.xview)
+        self.__canvas.config(xscrollcommand=h_scroll.set, yscrollcommand=v_scroll.set)
+        self.__canvas.grid(row=0, column=0, sticky=(N, S, W, E))
+        v_scroll.grid(row=0, column=1, sticky=(N, S))
+        h_scroll.grid(row=1, column=0, sticky=(W, E))
+
+        self.__grid = ttk.Frame(self.__canvas)
+        self.__canvas.create_window(0, 0, anchor='nw', window=self.__grid)
+        self.__cells = []
+        for index in range(len(sweep)):
+            cell = ttk.Label(self.__grid, text=sweep.label(index) + '\ncomputing...', compound='top', anchor='center')
+            cell.grid(row=index // sweep.shape[1], column=index % sweep.shape[1], padx=2, pady=2)
+            cell.bind('<Button-1>', lambda event, i=index: self.__on_select(i))
+            self.__cells.append(cell)
+        self.__update_scroll_region()
+
+        self.protocol('WM_DELETE_WINDOW', self.__close)
+        self.after(self.POLL_INTERVAL, self.__poll)
+
+    def __update_scroll_region(self):
+        self.__grid.update_idletasks()
+        self.__canvas.config(scrollregion=self.__canvas.bbox('all'),
+                             width=min(self.__grid.winfo_reqwidth(), 1000),
+                             height=min(self.__grid.winfo_reqheight(), 700))
+
+    def __poll(self):
+        for index, result in self.__sweep.poll():
+            if isinstance(result, Exception):
+                self.__cells[index].configure(text=f'{self.__sweep.label(index)}\nerror: {result}')
+            else:
+                self.__thumbnails[index] = ImageTk.PhotoImage(Image.fromarray(result))
+                self.__cells[index].configure(image=self.__thumbnails[index], text=self.__sweep.label(index))
+        self.__update_scroll_region()
+        if not self.__sweep.finished:
+            self.after(self.POLL_INTERVAL, self.__poll)
+
+    def __close(self):
+        self.__sweep.cancel()
+        self.destroy()
+
+
+class HistogramView(ttk.Frame):
+    # histogram drawn as one polyline per channel, redrawn when the widget is resized
+    def __init__(self, master=None, **kw):
+        super().__init__(master, **kw)
+        self.rowconfigure(0, weight=1)
+        self.columnconfigure(0, weight=1)
+        self.__histogram = None
+        self.__canvas = Canvas(self, background='white', highlightthickness=0, width=256, height=200)
+        self.__canvas.grid(row=0, column=0, sticky=(N, S, W, E))
+        self.__canvas.bind('<Configure>', lambda event: self.__draw())
+
+    @property
+    def histogram(self):
+        return self.__histogram
+
+    @histogram.setter
+    def histogram(self, histogram):
+        self.__histogram = histogram
+        self.__draw()
+
+    def __draw(self):
+        self.__canvas.delete('all')
+        if self.__histogram is None:
+            return
+        colors = [GRAY_COLOR] if len(self.__histogram) == 1 else CHANNEL_COLORS
+        lines = histogram_lines(self.__histogram, self.__canvas.winfo_width(), self.__canvas.winfo_height())
+        for line, color in zip(lines, colors):
+            self.__canvas.create_line(*line, fill=color)
+
+
+class VideoWindow(Toplevel):
+    # shows frames of VideoProcessor at most DEFAULT_DISPLAY_FPS times per second
+    MAX_WIDTH = 960
+
+    def __init__(self, master, processor, face_detector, **kw):
+        super().__init__(master, **kw)
+        self.title('Video')
+        self.__processor = processor
+        self.__face_detector = face_detector
+        self.__encoder = PpmEncoder()
+        self.__photo = PhotoImage(master=self)
+
+        self.__display = ttk.Label(self, anchor='center', image=self.__photo)
+        self.__display.grid(row=0, column=0, columnspan=2, sticky=(N, S, W, E))
+        self.__detect_faces = BooleanVar()
+        detect_checkbutton = ttk.Checkbutton(self, text='Detect faces (haar)', variable=self.__detect_faces,
+                                             command=self.__toggle_detection)
+        detect_checkbutton.grid(row=1, column=0, sticky=W, padx=5, pady=5)
+        self.__status = ttk.Label(self, anchor='w')
+        self.__status.grid(row=1, column=1, sticky=(W, E), padx=5, pady=5)
+
+        self.protocol('WM_DELETE_WINDOW', self.__close)
+        self.__processor.start()
+        self.after(1000 // DEFAULT_DISPLAY_FPS, self.__poll)
+
+    def __toggle_detection(self):
+        detector = self.__face_detector() if self.__detect_faces.get() else None
+        if self.__detect_faces.get() and detector is None:
+            self.__detect_faces.set(False)
+            messagebox.showinfo(title='Face detection', message='Haar cascade is not loaded yet, try again later')
+        self.__processor.detector = detector
+
+    def __poll(self):
+        # finished is read before take, so the last frame stored before finishing is always shown
+        finished = self.__processor.finished
+        frame = self.__processor.take()
+        if frame is not None:
+            with profiler.stage('video frame'):
+                scale = min(100, self.MAX_WIDTH * 100 / frame.shape[1])
+                self.__encoder.encode(frame, False, scale).paste(self.__photo)
+        statistics = format_statistics(self.__processor.statistics())
+        if self.__processor.error is not None:
+            self.__status.configure(text=f'Error: {self.__processor.error}')
+        elif finished:
+            self.__status.configure(text=f'Finished: {statistics}')
+        else:
+            self.__status.configure(text=statistics)
+            self.after(1000 // DEFAULT_DISPLAY_FPS, self.__poll)
+
+    def __close(self):
+        self.__processor.stop()
+        self.destroy()
+
+
 class MainWindow:
+    # delay (in ms) between the last parameter change and start of live preview
+    LIVE_PREVIEW_DELAY = 150
+    LIVE_PREVIEW_POLL_INTERVAL = 30
+    MODEL_STATE_POLL_INTERVAL = 100
+    TILED_JOB_POLL_INTERVAL = 200
+    LOADING_POLL_INTERVAL = 50
+    EXPORT_POLL_INTERVAL = 50
+    # images are rendered at most once per this interval (in ms) while the scale slider is dragged
+    SCALE_THROTTLE_INTERVAL = 40
+
     def __init__(self, root: Tk):
         self.__root = root
         self.__image_manager = ImageManager()
+        self.__preview_worker = PreviewWorker()
+        self.__live_preview_after_id = None
+        # encoder options chosen in the last export, used by Save as well
+        self.__png_compression = DEFAULT_PNG_COMPRESSION
+        self.__jpeg_quality = DEFAULT_JPEG_QUALITY
         root.rowconfigure(0, weight=1)
         root.columnconfigure(0, weight=1)
 
@@ -126,6 +347,12 @@ class MainWindow:
         file_menu = Menu(menu_bar)
         file_menu.add_command(label='Open', command=self.open_file)
         file_menu.add_command(label="Save", command=self.save_image_as, accelerator='Ctrl-s')
+        file_menu.add_command(label='Open Session', command=self.open_session)
+        file_menu.add_command(label='Save Session', command=self.save_session)
+        file_menu.add_command(label='Export History', command=self.export_history)
+        file_menu.add_command(label='Export Pipeline', command=self.export_pipeline)
+        file_menu.add_command(label='Process Video', command=self.open_video)
+        file_menu.add_command(label='Process Large Image', command=self.process_large_image)
         menu_bar.add_cascade(menu=file_menu, label='File')
 
         edit_menu = Menu(menu_bar)
@@ -134,6 +361,9 @@ class MainWindow:
         edit_menu.add_command(label='Rotate 180° ↷', command=self.gui_update_wrapper(self.__image_manager.rotate_by_180, True))
         edit_menu.add_command(label='Rotate -90° ↶', command=self.gui_update_wrapper(self.__image_manager.rotate_by_270, True))
         edit_menu.add_command(label="Grayscale", command=self.gui_update_wrapper(self.__image_manager.to_grayscale, True), accelerator='Ctrl-g')
+        edit_menu.add_separator()
+        self.__proxy_mode_var = BooleanVar(value=self.__image_manager.proxy_mode)
+        edit_menu.add_checkbutton(label='Proxy Preview', variable=self.__proxy_mode_var, command=self.toggle_proxy_mode)
         menu_bar.add_cascade(menu=edit_menu, label='Edit')
 
         blurs_menu = Menu(menu_bar)
@@ -158,18 +388,30 @@ class MainWindow:
         advanced_menu = Menu(menu_bar)
         advanced_menu.add_command(label='Canny', command=lambda: self.show_parameters_panel(self.__canny_menu))
         advanced_menu.add_command(label='Histogram', command=self.show_histogram)
-        face_detection_menu = Menu(advanced_menu)
-        face_detection_menu.add_command(label='Haar Cascade Face Detection', command=lambda: self.show_parameters_panel(self.__haar_menu))
-        face_detection_menu.add_command(label='Facial Landmarks Detection', command=lambda: self.show_parameters_panel(self.__shape_predictor_menu))
+        # models start loading as soon as the user opens this menu
+        face_detection_menu = Menu(advanced_menu, postcommand=self.load_face_models)
+        face_detection_menu.add_command(label='Haar Cascade Face Detection', command=lambda: self.show_face_detection_panel(self.__haar_menu))
+        face_detection_menu.add_command(label='Facial Landmarks Detection', command=lambda: self.show_face_detection_panel(self.__shape_predictor_menu))
         advanced_menu.add_cascade(menu=face_detection_menu, label='Face Detection')
+        advanced_menu.add_separator()
+        self.__record_trace_var = BooleanVar(value=profiler.recording)
+        advanced_menu.add_checkbutton(label='Record Trace', variable=self.__record_trace_var,
+                                      command=self.toggle_trace_recording)
+        advanced_menu.add_command(label='Export Trace', command=self.export_trace)
         menu_bar.add_cascade(menu=advanced_menu, label='Advanced')
 
+        # list of open images is rebuilt every time the menu is opened
+        self.__images_menu = Menu(menu_bar, postcommand=self.update_images_menu)
+        self.__active_image_var = IntVar(value=0)
+        menu_bar.add_cascade(menu=self.__images_menu, label='Images')
+
         root['menu'] = menu_bar
 
         #       Create status bar with scale
 
         self.__scale_var = StringVar()
         self.__scale_val = 100
+        self.__scale_after_id = None
         self.__scale_var.set("100%")
 
         bottom_panel = ttk.Frame(main_window)
@@ -207,36 +449,58 @@ class MainWindow:
 
         self.__canny_menu = CannyMenu(self.__parameters_menu)
         self.__canny_menu.callback = self.gui_update_wrapper(self.__image_manager.canny)
+        self.__canny_menu.live_callback = self.gui_live_wrapper('canny')
+        self.__canny_menu.sweep_callback = self.gui_sweep_wrapper('canny', self.__canny_menu)
 
         self.__median_blur_menu = MedianBlur(self.__parameters_menu)
         self.__median_blur_menu.callback = self.gui_update_wrapper(self.__image_manager.median_blur)
+        self.__median_blur_menu.live_callback = self.gui_live_wrapper('median_blur')
+        self.__median_blur_menu.sweep_callback = self.gui_sweep_wrapper('median_blur', self.__median_blur_menu)
 
         self.__gaussian_blur_menu = GeneralBlurMenu(self.__parameters_menu, 'Gaussian blur')
         self.__gaussian_blur_menu.callback = self.gui_update_wrapper(self.__image_manager.gaussian_blur)
+        self.__gaussian_blur_menu.live_callback = self.gui_live_wrapper('gaussian_blur')
+        self.__gaussian_blur_menu.sweep_callback = self.gui_sweep_wrapper('gaussian_blur', self.__gaussian_blur_menu)
 
         self.__averaging_blur_menu = GeneralBlurMenu(self.__parameters_menu, 'Averaging')
         self.__averaging_blur_menu.callback = self.gui_update_wrapper(self.__image_manager.averaging_blur)
+        self.__averaging_blur_menu.live_callback = self.gui_live_wrapper('averaging_blur')
+        self.__averaging_blur_menu.sweep_callback = self.gui_sweep_wrapper('averaging_blur', self.__averaging_blur_menu)
 
         self.__bilateral_filter_menu = BilateralFilterMenu(self.__parameters_menu)
         self.__bilateral_filter_menu.callback = self.gui_update_wrapper(self.__image_manager.bilateral_filter)
+        self.__bilateral_filter_menu.live_callback = self.gui_live_wrapper('bilateral_filter')
+        self.__bilateral_filter_menu.sweep_callback = self.gui_sweep_wrapper('bilateral_filter', self.__bilateral_filter_menu)
 
         self.__global_threshold_menu = GlobalThresholdMenu(self.__parameters_menu)
         self.__global_threshold_menu.callback = self.gui_update_wrapper(self.__image_manager.global_threshold)
+        self.__global_threshold_menu.live_callback = self.gui_live_wrapper('global_threshold')
+        self.__global_threshold_menu.sweep_callback = self.gui_sweep_wrapper('global_threshold', self.__global_threshold_menu)
 
         self.__adaptive_mean_threshold_menu = AdaptiveThresholdMenu(self.__parameters_menu, 'Adaptive Mean Threshold')
         self.__adaptive_mean_threshold_menu.callback = self.gui_update_wrapper(self.__image_manager.mean_threshold)
+        self.__adaptive_mean_threshold_menu.live_callback = self.gui_live_wrapper('mean_threshold')
+        self.__adaptive_mean_threshold_menu.sweep_callback = self.gui_sweep_wrapper('mean_threshold', self.__adaptive_mean_threshold_menu)
 
         self.__adaptive_gauss_threshold_menu = AdaptiveThresholdMenu(self.__parameters_menu, 'Adaptive Gauss Threshold')
         self.__adaptive_gauss_threshold_menu.callback = self.gui_update_wrapper(self.__image_manager.gaussian_threshold)
+        self.__adaptive_gauss_threshold_menu.live_callback = self.gui_live_wrapper('gaussian_threshold')
+        self.__adaptive_gauss_threshold_menu.sweep_callback = self.gui_sweep_wrapper('gaussian_threshold', self.__adaptive_gauss_threshold_menu)
 
         self.__sobel_x_menu = GradientMenu(self.__parameters_menu, 'Sobel X')
         self.__sobel_x_menu.callback = self.gui_update_wrapper(self.__image_manager.sobel_x)
+        self.__sobel_x_menu.live_callback = self.gui_live_wrapper('sobel_x')
+        self.__sobel_x_menu.sweep_callback = self.gui_sweep_wrapper('sobel_x', self.__sobel_x_menu)
 
         self.__sobel_y_menu = GradientMenu(self.__parameters_menu, 'Sobel Y')
         self.__sobel_y_menu.callback = self.gui_update_wrapper(self.__image_manager.sobel_y)
+        self.__sobel_y_menu.live_callback = self.gui_live_wrapper('sobel_y')
+        self.__sobel_y_menu.sweep_callback = self.gui_sweep_wrapper('sobel_y', self.__sobel_y_menu)
 
         self.__laplacian_menu = GradientMenu(self.__parameters_menu, 'Laplacian')
         self.__laplacian_menu.callback = self.gui_update_wrapper(self.__image_manager.laplacian)
+        self.__laplacian_menu.live_callback = self.gui_live_wrapper('laplacian')
+        self.__laplacian_menu.sweep_callback = self.gui_sweep_wrapper('laplacian', self.__laplacian_menu)
 
         self.__haar_menu = HaarCascadeMenu(self.__parameters_menu)
         self.__haar_menu.callback = self.gui_detect_wrapper(self.__image_manager.haar_face_detection)
@@ -262,6 +526,19 @@ class MainWindow:
         self.__queue.list = self.__image_manager.prev_commands
         self.__queue.grid(row=2, column=0, sticky=(N, S, W, E))
 
+        #       Create histogram panel (notebook)
+
+        self.__histogram_panel = ttk.Frame(self.__right_panel)
+        self.__right_panel.add(self.__histogram_panel, text='Histogram')
+        self.__histogram_panel.columnconfigure(0, weight=1)
+        self.__histogram_panel.rowconfigure(1, weight=1)
+        self.__histogram_label = ttk.Label(self.__histogram_panel, anchor='center')
+        self.__histogram_label.grid(row=0, column=0, sticky=(W, E))
+        self.__histogram_view = HistogramView(self.__histogram_panel)
+        self.__histogram_view.grid(row=1, column=0, sticky=(N, S, W, E), padx=5, pady=5)
+        # histogram is computed only when its tab is visible
+        self.__right_panel.bind('<<NotebookTabChanged>>', lambda event: self.update_histogram())
+
         #       binds
 
         root.bind('<Control-z>', self.undo)
@@ -270,45 +547,139 @@ class MainWindow:
         root.bind('<Control-g>', self.event_wrapper(self.gui_update_wrapper(self.__image_manager.to_grayscale, True)))
         root.bind('<Control-s>', self.event_wrapper(self.save_image_as))
 
+        root.after(self.LIVE_PREVIEW_POLL_INTERVAL, self.__poll_live_preview)
+
 
     def open_file(self):
-        filename = fd.askopenfilename(title="Select image", filetypes=(("jpeg files", "*.jpg"), ("png files", "*.png")))
+        filename = fd.askopenfilename(title="Select image", filetypes=(("jpeg files", "*.jpg *.jpeg"),
+                                                                       ("png files", "*.png"),
+                                                                       ("memory-mapped images", "*.npy *.raw")))
         if filename != "":
-            if re.match(r".*?((\.jpg)|(\.png))", filename) is None:
-                print(re.match(r".*?((\.jpg)|(\.png))", filename))
+            if re.match(r".*?((\.jpe?g)|(\.png)|(\.npy)|(\.raw))$", filename, re.IGNORECASE) is None:
                 messagebox.showerror(title="Error", message="File format is incorrect\nFilename must "
-                                                            "end with .png or .jpg")
+                                                            "end with .png, .jpg, .npy or .raw")
                 return
-            answer = messagebox.askyesno(title="Open Image", message="Do you want to open new Image? "
-                                                                     "All unsaved work will be lost!")
-            if answer is True:
-                self.__image_manager.open_image_from_path(filename)
-                self.__left_image_window.image = self.__image_manager.image
-                self.__right_image_window.image = self.__image_manager.manipulated_image
-                self.__queue.list = self.__image_manager.prev_commands
-                self.__queue.clear_selection()
+            # image is opened next to the already open ones (see Images menu)
+            self.__cancel_live_preview()
+            start = time.perf_counter()
+            success, message = self.__image_manager.open_image_from_path(filename)
+            if not success:
+                self.__status_bar.configure(text=f"Status: {message}")
+                return
+            self.__face_detected = False
+            self.__show_opened_image()
+            self.__root.update_idletasks()
+            first_pixel = (time.perf_counter() - start) * 1000
+            self.__status_bar.configure(text=f"Status: First pixel after {first_pixel:.0f} ms. {message}")
+            if self.__image_manager.loading:
+                self.__root.after(self.LOADING_POLL_INTERVAL, self.__poll_loading)
+
+    def open_session(self):
+        filename = fd.askopenfilename(title="Select session", filetypes=(("sessions", "*.session"),))
+        if not filename:
+            return
+        self.__cancel_live_preview()
+        success, message = self.__image_manager.open_session(filename)
+        if success:
+            self.__face_detected = False
+            self.__show_opened_image()
+        self.__status_bar.configure(text=f"Status: {message}")
+
+    def save_session(self):
+        filename = fd.asksaveasfilename(title="Save session as...", defaultextension='.session',
+                                        filetypes=(("sessions", "*.session"),))
+        if filename:
+            self.__status_bar.configure(text=f"Status: {self.__image_manager.save_session(filename)[1]}")
+
+    def update_images_menu(self):
+        self.__images_menu.delete(0, END)
+        for index, name in enumerate(self.__image_manager.images):
+            self.__images_menu.add_radiobutton(label=name, variable=self.__active_image_var, value=index,
+                                               command=lambda i=index: self.switch_image(i))
+        self.__active_image_var.set(self.__image_manager.active_image)
+        self.__images_menu.add_separator()
+        self.__images_menu.add_command(label='Close Image', command=self.close_image)
+
+    def switch_image(self, index):
+        self.__cancel_live_preview()
+        success, message = self.__image_manager.switch_image(index)
+        if success:
+            self.__face_detected = False
+            self.__show_opened_image()
+        self.__status_bar.configure(text=f"Status: {message}")
+
+    def close_image(self):
+        self.__cancel_live_preview()
+        success, message = self.__image_manager.close_image()
+        if success:
+            self.__face_detected = False
+            self.__show_opened_image()
+        self.__status_bar.configure(text=f"Status: {message}")
+
+    def __show_opened_image(self):
+        self.__left_image_window.image = self.__image_manager.image
+        self.__right_image_window.image = self.__image_manager.manipulated_image
+        self.__queue.list = [] if self.__image_manager.loading else self.__image_manager.prev_commands
+        self.__queue.clear_selection()
+        self.update_histogram()
+
+    def __poll_loading(self):
+        finished, success, message = self.__image_manager.poll_loading()
+        if not finished:
+            if self.__image_manager.loading:
+                self.__root.after(self.LOADING_POLL_INTERVAL, self.__poll_loading)
+            return
+        self.__show_opened_image()
+        self.__status_bar.configure(text=f"Status: {message}")
 
     def scale_image(self, scale):
         scale_temp_int = int(getdouble(scale))
         if scale_temp_int != self.__scale_val:
             self.__scale_val = scale_temp_int
             self.__scale_var.set(str(self.__scale_val) + "%")
-            self.__image_manager.scale = scale_temp_int
+            if self.__scale_after_id is None:
+                self.__scale_after_id = self.__root.after(self.SCALE_THROTTLE_INTERVAL, self.__apply_scale)
+
+    def __apply_scale(self):
+        # renders images only for the newest value of the slider
+        self.__scale_after_id = None
+        if self.__image_manager.scale != self.__scale_val:
+            self.__image_manager.scale = self.__scale_val
             self.__left_image_window.image = self.__image_manager.image if not self.__face_detected else self.__image_manager.image_with_faces
             if self.__queue.get_selection() == ():
                 self.__right_image_window.image = self.__image_manager.manipulated_image
             else:
                 self.__right_image_window.image = self.__image_manager.get_prev_image(self.__queue.get_selection()[0])
 
+    def toggle_proxy_mode(self):
+        self.__image_manager.proxy_mode = self.__proxy_mode_var.get()
+
     def show_prev_image(self, i):
         self.__right_image_window.image = self.__image_manager.get_prev_image(i)
+        self.update_histogram()
 
     def refresh_image_and_commands(self):
-        if self.__face_detected:
+        # operation may have finished loading of opened image, then its reduced preview is replaced
+        finished, success, message = self.__image_manager.poll_loading()
+        if finished or self.__face_detected:
             self.__left_image_window.image = self.__image_manager.image
             self.__face_detected = False
+        if finished:
+            self.__queue.clear_selection()
+            self.__status_bar.configure(text=f"Status: {message}")
         self.__right_image_window.image = self.__image_manager.manipulated_image
         self.__queue.list = self.__image_manager.prev_commands
+        self.update_histogram()
+
+    def update_histogram(self):
+        # while image is loading, histogram would have to wait for it
+        if self.__right_panel.select() != str(self.__histogram_panel) or self.__image_manager.loading:
+            return
+        selection = self.__queue.get_selection()
+        number = None if selection == () else selection[0]
+        self.__histogram_view.histogram = self.__image_manager.histogram(number)
+        self.__histogram_label.configure(text='Manipulated image' if number is None
+                                         else self.__image_manager.prev_commands[number])
 
     def save_image_as(self):
         filename = fd.asksaveasfile(title="Save as...", filetypes=(("jpeg files", "*.jpg"), ("png files", "*.png")))
@@ -320,13 +691,77 @@ class MainWindow:
                 messagebox.showerror(title="Incorrect name", message=f"Path:{filename} is incorrect\nFilename must end "
                                                                      f"with .png or .jpg")
                 return
+            scale = False
             if self.__scale_val != 100:
                 scale = messagebox.askyesno(title="Scale Image?", message="Do you want to save image with CUSTOM "
                                                                           "scale? If so you may expect decrease of"
                                                                           " quality")
-                self.__image_manager.save_image(filename, scale, self.__queue.get_selection())
-            else:
-                self.__image_manager.save_image(filename, False, self.__queue.get_selection())
+            self.__poll_export(self.__image_manager.save_image(filename, scale, self.__queue.get_selection(),
+                                                               self.__png_compression, self.__jpeg_quality))
+
+    def export_history(self):
+        def start_export(indices, directory, extension, png_compression, jpeg_quality):
+            self.__png_compression = png_compression
+            self.__jpeg_quality = jpeg_quality
+            self.__poll_export(self.__image_manager.export_history(directory, indices, extension, png_compression,
+                                                                   jpeg_quality))
+
+        ExportDialog(self.__root, self.__image_manager.prev_commands, self.__png_compression, self.__jpeg_quality,
+                     start_export)
+
+    def __poll_export(self, job):
+        # images are given to encoder threads here, so the interface stays responsive during export
+        if not job.pump():
+            done, total = job.progress
+            self.__status_bar.configure(text=f"Status: Exporting {done}/{total}")
+            self.__root.after(self.EXPORT_POLL_INTERVAL, self.__poll_export, job)
+        elif job.errors:
+            path, error = job.errors[0]
+            self.__status_bar.configure(text=f"Status: Export failed for {len(job.errors)} images: {error}")
+        else:
+            self.__status_bar.configure(text=f"Status: Exported {job.progress[1]} images in {job.duration:.2f} s")
+
+    def export_pipeline(self):
+        filename = fd.asksaveasfilename(title="Export pipeline as...", defaultextension='.json',
+                                        filetypes=(("pipeline files", "*.json"),))
+        if filename:
+            self.__image_manager.export_pipeline(filename)
+            self.__status_bar.configure(text=f"Status: Pipeline exported to {filename}")
+
+    def open_video(self):
+        filename = fd.askopenfilename(title="Select video", filetypes=(("video files", "*.mp4 *.avi *.mov *.mkv"),
+                                                                       ("all files", "*.*")))
+        if not filename:
+            return
+        output_path = None
+        if messagebox.askyesno(title="Process Video", message="Do you want to save the processed video?"):
+            output_path = fd.asksaveasfilename(title="Save video as...", defaultextension='.mp4',
+                                               filetypes=(("mp4 files", "*.mp4"),)) or None
+        success, error_message, processor = self.__image_manager.video_processor(filename, output_path)
+        self.__status_bar.configure(text=f"Status: {error_message}")
+        if success:
+            VideoWindow(self.__root, processor, self.__image_manager.video_face_detector)
+
+    def process_large_image(self):
+        input_path = fd.askopenfilename(title="Select large image",
+                                        filetypes=(("images", "*.npy *.tif *.tiff *.png *.jpg"), ("all files", "*.*")))
+        if not input_path:
+            return
+        output_path = fd.asksaveasfilename(title="Save result as...", defaultextension='.npy',
+                                           filetypes=(("memory-mappable arrays", "*.npy"), ("tiff files", "*.tif"),
+                                                      ("png files", "*.png")))
+        if output_path:
+            self.__poll_tiled_job(self.__image_manager.process_large_image(input_path, output_path), output_path)
+
+    def __poll_tiled_job(self, job, output_path):
+        if job.error is not None:
+            self.__status_bar.configure(text=f"Status: Processing failed: {job.error}")
+        elif job.finished:
+            self.__status_bar.configure(text=f"Status: Saved {output_path} in {job.duration:.1f} s")
+        else:
+            step, steps_count, done, total = job.progress
+            self.__status_bar.configure(text=f"Status: Processing step {step + 1}/{steps_count}, tile {done}/{total}")
+            self.__root.after(self.TILED_JOB_POLL_INTERVAL, self.__poll_tiled_job, job, output_path)
 
     def show_parameters_panel(self, panel):
         if self.__active_menu is not None:
@@ -335,43 +770,132 @@ class MainWindow:
         panel.grid(row=1, column=0, sticky=(N, S, W, E))
         self.show_parameters_menu()
 
+    def load_face_models(self):
+        self.__image_manager.load_haar_cascade()
+        self.__image_manager.load_shape_predictor()
+
+    def show_face_detection_panel(self, panel):
+        self.load_face_models()
+        self.show_parameters_panel(panel)
+        self.__poll_model_states()
+
+    def __poll_model_states(self):
+        self.__haar_menu.model_state = self.__image_manager.haar_cascade_state
+        self.__shape_predictor_menu.model_state = self.__image_manager.shape_predictor_state
+        if LOADING in (self.__haar_menu.model_state, self.__shape_predictor_menu.model_state):
+            self.__root.after(self.MODEL_STATE_POLL_INTERVAL, self.__poll_model_states)
+
+    def show_status(self, message):
+        # status is followed by time breakdown of the last measured action
+        breakdown = profiler.format_breakdown()
+        self.__status_bar.configure(text=f"Status: {message}" + (f"   [{breakdown}]" if breakdown else ""))
+
     def gui_update_wrapper(self, function, always_accept=False):
         def wrapper(*args):
-            success, error_message = function(*args)
-            self.__status_bar.configure(text=f"Status: {error_message}")
-            self.refresh_image_and_commands()
+            self.__cancel_live_preview()
+            with profiler.stage('total'):
+                success, error_message = function(*args)
+                self.refresh_image_and_commands()
+            self.show_status(error_message)
 
         def always_accept_wrapper(*args):
-            success, error_message = function(*args, accept=True)
-            self.__status_bar.configure(text=f"Status: {error_message}")
-            self.refresh_image_and_commands()
+            self.__cancel_live_preview()
+            with profiler.stage('total'):
+                success, error_message = function(*args, accept=True)
+                self.refresh_image_and_commands()
+            self.show_status(error_message)
 
         if always_accept:
             return always_accept_wrapper
         else:
             return wrapper
 
-    def gui_detect_wrapper(self, function):
+    def gui_live_wrapper(self, operation_name):
+        # debounced preview computed on background thread, results are shown by __poll_live_preview
+        def submit(*args):
+            self.__live_preview_after_id = None
+            success, error_message, job = self.__image_manager.preview_job(operation_name, *args)
+            if not success:
+                self.__status_bar.configure(text=f"Status: {error_message}")
+                return
+            self.__status_bar.configure(text="Status: computing preview...")
+            self.__preview_worker.submit(job)
+
         def wrapper(*args):
-            success, error_message = function(*args)
+            if self.__live_preview_after_id is not None:
+                self.__root.after_cancel(self.__live_preview_after_id)
+            self.__live_preview_after_id = self.__root.after(self.LIVE_PREVIEW_DELAY, submit, *args)
+        return wrapper
+
+    def __cancel_live_preview(self):
+        if self.__live_preview_after_id is not None:
+            self.__root.after_cancel(self.__live_preview_after_id)
+            self.__live_preview_after_id = None
+        self.__preview_worker.cancel()
+
+    def __poll_live_preview(self):
+        ready, result = self.__preview_worker.poll()
+        if ready:
+            if isinstance(result, Exception):
+                self.__status_bar.configure(text=f"Status: {result}")
+            else:
+                with profiler.stage('total'):
+                    success, error_message = self.__image_manager.set_preview(result)
+                    if success:
+                        self.refresh_image_and_commands()
+                if success:
+                    self.show_status(error_message)
+        self.__root.after(self.LIVE_PREVIEW_POLL_INTERVAL, self.__poll_live_preview)
+
+    def gui_sweep_wrapper(self, operation_name, menu):
+        def start_sweep(parameters, ranges):
+            success, error_message, sweep = self.__image_manager.sweep(operation_name, parameters, ranges)
             self.__status_bar.configure(text=f"Status: {error_message}")
             if success:
-                self.__face_detected = True
-                self.__left_image_window.image = self.__image_manager.image_with_faces
-                self.__right_image_window.image = self.__image_manager.get_prev_image(-1)
+                ContactSheet(self.__root, sweep, lambda index: self.load_parameters(menu, sweep.combinations[index]))
+
+        def wrapper(*args):
+            parameters = operations.OPERATIONS[operation_name].bind(*args)
+            names = [name for name, value in parameters.items()
+                     if isinstance(value, (int, float)) and not isinstance(value, bool)]
+            SweepDialog(self.__root, parameters, names, lambda ranges: start_sweep(parameters, ranges))
+        return wrapper
+
+    def load_parameters(self, menu, parameters):
+        menu.set_arguments(*parameters.values())
+        self.show_parameters_panel(menu)
+
+    def gui_detect_wrapper(self, function):
+        def wrapper(*args):
+            with profiler.stage('total'):
+                success, error_message = function(*args)
+                if success:
+                    self.__face_detected = True
+                    self.__left_image_window.image = self.__image_manager.image_with_faces
+                    self.__right_image_window.image = self.__image_manager.get_prev_image(-1)
+            self.show_status(error_message)
         return wrapper
 
     def undo(self, event=None):
+        self.__cancel_live_preview()
         success, error_message = self.__image_manager.undo()
         if success:
             self.__face_detected = False
             self.refresh_image_and_commands()
         self.__status_bar.configure(text=f"Status: {error_message}")
 
+    def toggle_trace_recording(self):
+        profiler.recording = self.__record_trace_var.get()
+
+    def export_trace(self):
+        filename = fd.asksaveasfilename(title="Export trace as...", defaultextension='.json',
+                                        filetypes=(("Chrome trace files", "*.json"),))
+        if filename:
+            profiler.export_chrome_trace(filename)
+            self.__status_bar.configure(text=f"Status: Trace exported to {filename}")
+
     def show_histogram(self):
-        selection = self.__queue.get_selection()
-        num = None if selection == () else selection[0]
-        self.__image_manager.display_histogram(num)
+        self.__right_panel.select(self.__histogram_panel)
 
     def show_parameters_menu(self, event=None, menu: int = 0):
         self.__right_panel.select(menu)
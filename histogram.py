@@ -0,0 +1,26 @@
+import cv2
+import numpy as np
+
+BINS = 256
+# colors of histogram lines of BGR channels
+CHANNEL_COLORS = ('#1f5fff', '#1fa01f', '#e02020')
+GRAY_COLOR = '#404040'
+
+
+def compute_histogram(image, is_grayscale):
+    # returns array (channels, 256) of pixel counts; calcHist is used because it is several times faster than
+    # np.bincount on big images and does not need any temporary copy of the image
+    channels = 1 if is_grayscale else image.shape[2]
+    histogram = np.empty((channels, BINS), dtype=np.float32)
+    for channel in range(channels):
+        histogram[channel] = cv2.calcHist([image], [channel], None, [BINS], [0, BINS]).ravel()
+    return histogram
+
+
+def histogram_lines(histogram, width, height, margin=4):
+    # returns coordinates of polylines (one per channel) drawing histogram in width x height area, all channels are
+    # scaled by the same maximum so they can be compared
+    maximum = max(float(histogram.max()), 1.0)
+    x = margin + np.arange(BINS) * (width - 2 * margin) / (BINS - 1)
+    y = height - margin - histogram / maximum * (height - 2 * margin)
+    return [np.column_stack((x, channel_y)).ravel().tolist() for channel_y in y]
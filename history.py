@@ -0,0 +1,323 @@
+import bisect
+import os
+import shutil
+import tempfile
+import weakref
+import zlib
+import numpy as np
+import operations
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+DEFAULT_KEYFRAME_INTERVAL = 5
+# accepted steps computed longer than this (in seconds) are always kept as keyframes
+DEFAULT_EXPENSIVE_TIME = 0.25
+
+
+class _HistoryEntry:
+    RAM = 'ram'
+    COMPRESSED = 'compressed'
+    DISK = 'disk'
+    # not read yet, data is a function reading the image (e.g. from a session file)
+    LAZY = 'lazy'
+    # data is a memory map of the file the image was opened from, it is already on disk so it takes no budget and
+    # is never compressed or spilled
+    MAPPED = 'mapped'
+
+    def __init__(self, data, is_grayscale, shape, dtype, tier=RAM):
+        self.is_grayscale = is_grayscale
+        self.shape = shape
+        self.dtype = dtype
+        self.tier = tier
+        self.data = data
+        self.path = None
+
+    @property
+    def memory_usage(self):
+        if self.tier == _HistoryEntry.RAM:
+            return self.data.nbytes
+        elif self.tier == _HistoryEntry.COMPRESSED:
+            return len(self.data)
+        return 0
+
+    @property
+    def image(self):
+        if self.tier in (_HistoryEntry.RAM, _HistoryEntry.MAPPED):
+            return self.data
+        elif self.tier == _HistoryEntry.COMPRESSED:
+            return np.frombuffer(zlib.decompress(self.data), dtype=self.dtype).reshape(self.shape)
+        elif self.tier == _HistoryEntry.LAZY:
+            return self.data()
+        return np.load(self.path, mmap_mode='r')
+
+    def compress(self, level):
+        # returns False when image does not compress well (e.g. noisy photos), such entries go straight to disk
+        compressed = zlib.compress(np.ascontiguousarray(self.data).data, level)
+        if len(compressed) > 0.9 * self.data.nbytes:
+            return False
+        self.data = compressed
+        self.tier = _HistoryEntry.COMPRESSED
+        return True
+
+    def spill(self, directory, name):
+        self.path = os.path.join(directory, f'{name}.npy')
+        memory_map = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype, shape=self.shape)
+        memory_map[...] = self.image
+        memory_map.flush()
+        del memory_map
+        self.data = None
+        self.tier = _HistoryEntry.DISK
+
+    def load(self):
+        if self.tier not in (_HistoryEntry.RAM, _HistoryEntry.MAPPED):
+            # lazily read image is already a new array
+            self.data = self.data() if self.tier == _HistoryEntry.LAZY else np.array(self.image)
+            self.release()
+            self.path = None
+            self.tier = _HistoryEntry.RAM
+
+    def release(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class HistoryStore:
+    # Stack of (image, is_grayscale) pairs kept under a memory budget. The newest entries stay in RAM, older ones
+    # are compressed with zlib (lossless) and when it's still not enough they are spilled to memory-mapped files.
+    # Images memory-mapped from the files they were opened from stay mapped and are not counted.
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, keep_recent=2, compression_level=1):
+        self.__memory_budget = memory_budget
+        self.__keep_recent = max(keep_recent, 1)
+        self.__compression_level = compression_level
+        self.__entries = []
+        self.__spill_dir = None
+        self.__spill_counter = 0
+
+    @property
+    def memory_budget(self):
+        return self.__memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, new_budget):
+        self.__memory_budget = new_budget
+        self.__enforce_budget()
+
+    @property
+    def memory_usage(self):
+        return sum(entry.memory_usage for entry in self.__entries)
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __getitem__(self, i):
+        entry = self.__entries[i]
+        if entry.tier == _HistoryEntry.LAZY:
+            # entry is read only once, then it is kept like any other
+            entry.load()
+            self.__enforce_budget()
+        return entry.image, entry.is_grayscale
+
+    def tier(self, i):
+        return self.__entries[i].tier
+
+    def append(self, image, is_grayscale):
+        tier = _HistoryEntry.MAPPED if isinstance(image, np.memmap) else _HistoryEntry.RAM
+        self.__entries.append(_HistoryEntry(image, is_grayscale, image.shape, image.dtype, tier))
+        self.__enforce_budget()
+
+    def append_lazy(self, read, shape, dtype, is_grayscale):
+        # read() returns the image, it is called on the first access
+        self.__entries.append(_HistoryEntry(read, is_grayscale, shape, dtype, _HistoryEntry.LAZY))
+
+    def pop(self, load_top=True):
+        self.__entries.pop().release()
+        # the new top of the stack becomes the working image again so it is brought back to RAM
+        if load_top and self.__entries:
+            self.__entries[-1].load()
+            self.__enforce_budget()
+
+    def evict(self, to_disk=False):
+        # compresses all entries (also the newest ones) or moves them to disk, for histories nobody works on
+        for entry in self.__entries:
+            if entry.tier == _HistoryEntry.RAM and not to_disk and entry.compress(self.__compression_level):
+                continue
+            if entry.tier in (_HistoryEntry.RAM, _HistoryEntry.COMPRESSED):
+                self.__spill(entry)
+
+    def load_top(self):
+        if self.__entries:
+            self.__entries[-1].load()
+            self.__enforce_budget()
+
+    def clear(self):
+        for entry in self.__entries:
+            entry.release()
+        self.__entries = []
+
+    def reset(self, image, is_grayscale):
+        self.clear()
+        self.append(image, is_grayscale)
+
+    def __get_spill_dir(self):
+        if self.__spill_dir is None:
+            self.__spill_dir = tempfile.mkdtemp(prefix='image_tester_history_')
+            weakref.finalize(self, shutil.rmtree, self.__spill_dir, True)
+        return self.__spill_dir
+
+    def __spill(self, entry):
+        self.__spill_counter += 1
+        entry.spill(self.__get_spill_dir(), self.__spill_counter)
+
+    def __enforce_budget(self):
+        old_entries = self.__entries[:-self.__keep_recent]
+        usage = self.memory_usage
+
+        # first compress the oldest entries
+        for entry in old_entries:
+            if usage <= self.__memory_budget:
+                return
+            if entry.tier == _HistoryEntry.RAM:
+                before = entry.memory_usage
+                if not entry.compress(self.__compression_level):
+                    self.__spill(entry)
+                usage -= before - entry.memory_usage
+
+        # then move compressed entries to disk
+        for entry in old_entries:
+            if usage <= self.__memory_budget:
+                return
+            if entry.tier == _HistoryEntry.COMPRESSED:
+                usage -= entry.memory_usage
+                self.__spill(entry)
+
+
+class HistoryRecord:
+    def __init__(self, operation, parameters, is_grayscale):
+        # operation is a name from operations.OPERATIONS, None for initial state
+        self.operation = operation
+        self.parameters = parameters
+        self.is_grayscale = is_grayscale
+
+    @property
+    def description(self):
+        if self.operation is None:
+            return 'Initial state'
+        return operations.OPERATIONS[self.operation].describe(self.parameters)
+
+
+class History:
+    # Accepted steps stored as (operation, parameters) records. Only keyframes (initial image, every n-th step and
+    # expensive steps) and the newest step keep their pixels in HistoryStore, other steps are rebuilt by replaying
+    # records from the nearest keyframe.
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 expensive_time=DEFAULT_EXPENSIVE_TIME):
+        self.__store = HistoryStore(memory_budget)
+        self.__keyframe_interval = keyframe_interval
+        self.__expensive_time = expensive_time
+        self.__records = []
+        # history indices of images kept in the store, the last one may be a temporary (not keyframe) top
+        self.__stored_indices = []
+        self.__top_is_keyframe = True
+        # the most recently rebuilt step, so walking through history does not replay everything again
+        self.__replayed = None
+
+    @property
+    def records(self):
+        return self.__records
+
+    @property
+    def descriptions(self):
+        return [record.description for record in self.__records]
+
+    @property
+    def keyframes(self):
+        return self.__stored_indices if self.__top_is_keyframe else self.__stored_indices[:-1]
+
+    @property
+    def memory_usage(self):
+        return self.__store.memory_usage
+
+    @property
+    def memory_budget(self):
+        return self.__store.memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, new_budget):
+        self.__store.memory_budget = new_budget
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __getitem__(self, i):
+        i = range(len(self.__records))[i]
+        position = bisect.bisect_right(self.__stored_indices, i) - 1
+        if self.__stored_indices[position] == i:
+            return self.__store[position]
+        return self.__rebuild(i), self.__records[i].is_grayscale
+
+    def reset(self, image, is_grayscale):
+        self.__records = [HistoryRecord(None, {}, is_grayscale)]
+        self.__store.reset(image, is_grayscale)
+        self.__stored_indices = [0]
+        self.__top_is_keyframe = True
+        self.__replayed = None
+
+    def restore(self, records, entries, keyframes):
+        # entries are (history index, read, shape, dtype) of stored images in ascending order, the first one must be
+        # the initial image and the last one the newest step; images are read with read() on first access
+        indices = [index for index, _, _, _ in entries]
+        if not records or not indices or indices[0] != 0 or indices[-1] != len(records) - 1:
+            raise ValueError('History must contain the initial and the newest image')
+        self.__records = list(records)
+        self.__store.clear()
+        for index, read, shape, dtype in entries:
+            self.__store.append_lazy(read, shape, dtype, self.__records[index].is_grayscale)
+        self.__stored_indices = indices
+        self.__top_is_keyframe = indices[-1] in keyframes
+        self.__replayed = None
+
+    def evict(self, to_disk=False):
+        # history is not used for now, so all its images are compressed (or moved to disk)
+        self.__replayed = None
+        self.__store.evict(to_disk)
+
+    def activate(self):
+        # the newest image is worked on, so it is brought back to RAM
+        self.__store.load_top()
+
+    def append(self, operation, parameters, image, is_grayscale, duration=0.0):
+        if not self.__top_is_keyframe:
+            self.__store.pop(load_top=False)
+            self.__stored_indices.pop()
+        index = len(self.__records)
+        self.__records.append(HistoryRecord(operation, parameters, is_grayscale))
+        self.__top_is_keyframe = (index - self.__stored_indices[-1] >= self.__keyframe_interval
+                                  or operations.OPERATIONS[operation].expensive
+                                  or duration >= self.__expensive_time)
+        self.__store.append(image, is_grayscale)
+        self.__stored_indices.append(index)
+
+    def pop(self):
+        self.__records.pop()
+        top = len(self.__records) - 1
+        if self.__replayed is not None and self.__replayed[0] > top:
+            self.__replayed = None
+        self.__stored_indices.pop()
+        if self.__stored_indices[-1] == top:
+            self.__store.pop()
+            self.__top_is_keyframe = True
+        else:
+            self.__store.pop(load_top=False)
+            self.__store.append(self.__rebuild(top), self.__records[top].is_grayscale)
+            self.__stored_indices.append(top)
+            self.__top_is_keyframe = False
+
+    def __rebuild(self, i):
+        position = bisect.bisect_right(self.__stored_indices, i) - 1
+        start = self.__stored_indices[position]
+        image = self.__store[position][0]
+        if self.__replayed is not None and start < self.__replayed[0] <= i:
+            start, image = self.__replayed
+        for record in self.__records[start + 1:i + 1]:
+            image = operations.apply(record.operation, image, record.parameters)
+        self.__replayed = (i, image)
+        return image
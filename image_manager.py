@@ -1,14 +1,34 @@
 import cv2
-from PIL import Image
 from PIL import ImageTk
 import copy as cp
 import numpy as np
-import dlib
-import matplotlib.pyplot as plt
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import operations
+from pipeline import save_pipeline, steps_from_records
+import face_detection
+from profiling import profiler
+from sweep import Sweep, sweep_values, MAX_COMBINATIONS
+from video import VideoProcessor, haar_detector
+from tiled import TiledJob
+from loader import ImageLoader
+from session import save_session, load_session
+from workspace import Workspace
+from pyramid import Pyramid
+from export import ExportJob, export_file_name, DEFAULT_PNG_COMPRESSION, DEFAULT_JPEG_QUALITY
+from history import History, DEFAULT_MEMORY_BUDGET
+from render_cache import RenderCache
+from histogram import compute_histogram
+from buffer_pool import BufferPool
+from display import TileSource, PpmEncoder, PpmImage, DEFAULT_TILED_THRESHOLD, DEFAULT_BACKEND, PPM_BACKEND, \
+    scale_image, to_pil_image
 
 
 class ImageManager:
-    def __init__(self):
+    def __init__(self, history_budget=DEFAULT_MEMORY_BUDGET, tiled_threshold=DEFAULT_TILED_THRESHOLD,
+                 display_backend=DEFAULT_BACKEND):
         #  image in BGR
         self.__image = cv2.imread("Assets/azunya.png")
 
@@ -19,43 +39,94 @@ class ImageManager:
         # image with detected faces
         self.__image_with_faces = self.__image.copy()
 
-        # load haar cascade
-        self.__haar_cascade_loaded = False
-        self.__haar_cascade = None
-        try:
-            self.__haar_cascade = cv2.CascadeClassifier('./FaceDetectionAssets/haarcascade_frontalface_default.xml')
-            self.__haar_cascade_loaded = True
-        except:
-            print('Could not load the haar cascade')
-
-        # load shape predictor
-        self.__detector = dlib.get_frontal_face_detector()
-        self.__shape_predictor_loaded = False
-        self.__shape_predictor = None
-        try:
-            self.__shape_predictor = dlib.shape_predictor("./FaceDetectionAssets/shape_predictor_68_face_landmarks.dat")
-            self.__shape_predictor_loaded = True
-        except:
-            print('Could not load the shape predictor')
-
-        # stack of images
-        self.__prev_images = [(self.__image, False)]
-        # stack of strings each containing description of used command
-        self.__prev_commands = ["Initial state"]
+        # face detection models are loaded in background on first use
+        self.__haar_cascade = face_detection.ModelLoader(face_detection.load_haar_cascade)
+        # (dlib face detector, shape predictor)
+        self.__dlib_models = face_detection.ModelLoader(face_detection.load_dlib_models)
+
+        # detected faces keyed by (digest of grayscale input, detector, detector parameters), so changes of drawing
+        # parameters and detection of the same image after undo only redraw faces
+        self.__detection_cache = RenderCache(max_entries=64, max_bytes=64 * 1024 * 1024)
+
+        # stack of accepted commands (operation with parameters), images of keyframes are kept under memory budget
+        # and other images are recomputed from the nearest keyframe
+        self.__history_budget = history_budget
+        self.__prev_images = History(history_budget)
+        self.__prev_images.reset(self.__image, False)
+        # open images with their histories, only the active one is not compressed
+        self.__workspace = Workspace(history_budget)
+        self.__workspace.add('azunya.png', self.__prev_images)
         # scale of images showed to user. Note: images are stored in original size.
         self.__scale = 100
+        # bigger displayed images are converted only in tiles visible on the screen
+        self.__tiled_threshold = tiled_threshold
+        self.__display_backend = display_backend
+        self.__ppm_encoder = PpmEncoder()
+
+        # rendered history entries keyed by (history index, scale, is grayscale)
+        self.__render_cache = RenderCache()
+        # histograms of history entries keyed by (history index,) and of the last preview as (image, histogram)
+        self.__histogram_cache = RenderCache(max_entries=256)
+        self.__preview_histogram = None
+        # pyramids of history entries keyed by (history index,), of the manipulated preview and of image with faces
+        self.__pyramid_cache = RenderCache(max_entries=8)
+        self.__preview_pyramid = None
+        self.__faces_pyramid = None
+        # history indices of displayed images, None when manipulated image is only a preview
+        self.__image_index = 0
+        self.__manipulated_index = 0
+        # changes every time history changes, so results of background previews computed for old state are ignored
+        self.__history_version = 0
+
+        # in proxy mode previews are computed on the last image downscaled to display scale
+        self.__proxy_mode = False
+        # ((history version, scale), downscaled image)
+        self.__proxy = None
+        # scale of manipulated image (other than 100 for proxy previews) and (operation, parameters) of proxy preview
+        self.__manipulated_scale = 100
+        self.__proxy_preview = None
+
+        # previews are written to reused buffers, manipulated image is returned to the pool when it is replaced
+        self.__buffer_pool = BufferPool()
+        self.__pooled_preview = False
+        # (history version, operation, parameters, duration) of full resolution preview, so accepting the same
+        # preview copies it instead of computing it again
+        self.__preview = None
+
+        # ImageLoader of image which is still being loaded in full resolution and (success, message) of finished
+        # load which was not reported by poll_loading yet (operations finish loading when they wait for it)
+        self.__loader = None
+        self.__load_result = None
+        # (thread pool, number of its workers) encoding exported images
+        self.__export_pool = None
 
     @property
     def image(self):
-        return self.image_to_tk(self.__image, False)
+        if self.__loader is not None:
+            return self.__reduced_image_to_tk()
+        return self.__cached_image_to_tk(self.__image_index)
 
     @property
     def manipulated_image(self):
-        return self.image_to_tk(self.__manipulated_image, self.__is_grayscale)
+        if self.__loader is not None:
+            return self.__reduced_image_to_tk()
+        if self.__manipulated_index is not None:
+            return self.__cached_image_to_tk(self.__manipulated_index)
+        # pyramid is only needed when the image is displayed downscaled
+        if self.__preview_pyramid is None and self.__scale < self.__manipulated_scale:
+            self.__preview_pyramid = Pyramid(self.__manipulated_image)
+        return self.image_to_tk(self.__manipulated_image, self.__is_grayscale, self.__manipulated_scale,
+                                self.__preview_pyramid)
 
     @property
     def image_with_faces(self):
-        return self.image_to_tk(self.__image_with_faces, False)
+        # image with faces is always a new array, so it is enough to compare identity
+        if self.__scale >= 100:
+            self.__faces_pyramid = None
+        elif self.__faces_pyramid is None or self.__faces_pyramid.image is not self.__image_with_faces:
+            self.__faces_pyramid = Pyramid(self.__image_with_faces)
+        return self.image_to_tk(self.__image_with_faces, self.__image_with_faces.ndim == 2,
+                                pyramid=self.__faces_pyramid)
 
     @property
     def scale(self):
@@ -66,260 +137,540 @@ class ImageManager:
         self.__scale = new_scale
 
     @property
-    def prev_commands(self):
-        return self.__prev_commands
+    def proxy_mode(self):
+        return self.__proxy_mode
 
-    def __scale_image(self, image):
-        if self.__scale != 100:
-            width = int(image.shape[1] * self.__scale / 100)
-            height = int(image.shape[0] * self.__scale / 100)
-            return cv2.resize(image, (width, height))
-        else:
-            return image
+    @proxy_mode.setter
+    def proxy_mode(self, new_proxy_mode):
+        self.__proxy_mode = new_proxy_mode
+        self.__proxy = None
 
-    def image_to_tk(self, cv_image, is_grayscale):
-        if not is_grayscale:
-            tk_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-            tk_image = self.__scale_image(tk_image)
-        else:
-            tk_image = self.__scale_image(cv_image)
-        tk_image = Image.fromarray(tk_image)
-        tk_image = ImageTk.PhotoImage(tk_image)
+    @property
+    def prev_commands(self):
+        return self.__prev_images.descriptions
+
+    @property
+    def history_records(self):
+        return self.__prev_images.records
+
+    # source_scale is the scale at which image is already stored (other than 100 only for proxy previews)
+    def __scale_image(self, image, source_scale=100):
+        return scale_image(image, self.__scale * 100 / source_scale)
+
+    def image_to_tk(self, cv_image, is_grayscale, source_scale=100, pyramid=None):
+        # with pyramid of cv_image, downscaled image is resampled from the nearest pyramid level
+        scale = self.__scale * 100 / source_scale
+        width = max(int(cv_image.shape[1] * scale / 100), 1)
+        height = max(int(cv_image.shape[0] * scale / 100), 1)
+        if pyramid is not None and scale < 100:
+            with profiler.stage('pyramid'):
+                cv_image, scale = pyramid.level(scale)
+        if width * height > self.__tiled_threshold:
+            return TileSource(cv_image, is_grayscale, scale)
+        if self.__display_backend == PPM_BACKEND:
+            with profiler.stage('encode ppm'):
+                return self.__ppm_encoder.encode_resized(cv_image, is_grayscale, width, height)
+        pil_image = to_pil_image(cv_image, is_grayscale, scale)
+        with profiler.stage('PhotoImage'):
+            return ImageTk.PhotoImage(pil_image)
+
+    def __cached_image_to_tk(self, index):
+        is_grayscale = self.__prev_images.records[index].is_grayscale
+        key = (index, self.__scale, is_grayscale)
+        tk_image = self.__render_cache.get(key)
+        if tk_image is None:
+            image = self.__prev_images[index][0]
+            pyramid = None
+            if self.__scale < 100:
+                pyramid = self.__pyramid_cache.get((index,))
+                if pyramid is None:
+                    pyramid = Pyramid(image)
+                    # pyramid keeps the image itself and lazily built levels which take a third of it
+                    self.__pyramid_cache.put((index,), pyramid, image.nbytes + image.nbytes // 3)
+            tk_image = self.image_to_tk(image, is_grayscale, pyramid=pyramid)
+            # tile source keeps the image it renders tiles from, which may be a replayed or decompressed copy
+            if isinstance(tk_image, TileSource):
+                size = image.nbytes
+            elif isinstance(tk_image, PpmImage):
+                size = len(tk_image.data)
+            else:
+                size = tk_image.width() * tk_image.height() * 4
+            self.__render_cache.put(key, tk_image, size)
         return tk_image
 
     def get_prev_image(self, i):
-        image, gray = self.__prev_images[i]
-        return self.image_to_tk(image, gray)
+        self.__ensure_loaded()
+        return self.__cached_image_to_tk(range(len(self.__prev_images))[i])
+
+    def __set_manipulated(self, image, pooled=False):
+        # previous preview buffer is not displayed anymore, so it can be reused
+        if self.__pooled_preview:
+            self.__buffer_pool.release(self.__manipulated_image)
+        self.__manipulated_image = image
+        self.__pooled_preview = pooled
+        self.__preview_histogram = None
+        self.__preview_pyramid = None
+        self.__preview = None
 
     def open_image_from_path(self, path):
-        self.__image = cv2.imread(path, cv2.IMREAD_COLOR)
-        self.__manipulated_image = self.__image.copy()
-        self.__prev_images = [(self.__image, False)]
-        self.__prev_commands = ["Initial state"]
-        self.__is_grayscale = False
-        self.__image_with_faces = self.__image.copy()
+        # returns (success, message). Until full resolution image is loaded in background, reduced one is displayed
+        # and operations wait for the full one
+        try:
+            loader = ImageLoader(path, self.__scale)
+        except (IOError, ValueError) as error:
+            return False, str(error)
+        self.__loader = loader
+        self.__load_result = None
+        if not loader.finished:
+            return True, f'Loading full resolution (showing {loader.reduced[1]:g}% preview)'
+        return self.poll_loading()[1:]
 
-    def rotate_by_90(self, accept=False):
-        self.__manipulated_image = cv2.rotate(self.__prev_images[-1][0], cv2.ROTATE_90_CLOCKWISE)
+    @property
+    def loading(self):
+        return self.__loader is not None
+
+    def poll_loading(self):
+        # returns (finished, success, message), full resolution image is used as soon as it is loaded. Every load is
+        # reported as finished once, also when an operation waiting for the image has already finished it
+        self.__finish_loading()
+        if self.__load_result is None:
+            return False, True, ''
+        (success, message), self.__load_result = self.__load_result, None
+        return True, success, message
+
+    def __finish_loading(self):
+        loader = self.__loader
+        if loader is None or not loader.finished:
+            return
+        self.__loader = None
+        if loader.error is not None:
+            self.__load_result = (False, str(loader.error))
+            return
+        history = History(self.__history_budget)
+        history.reset(loader.image, loader.image.ndim == 2)
+        self.__add_document(os.path.basename(loader.path), history)
+        self.__load_result = (True, f'Image loaded in {loader.full_time * 1000:.0f} ms')
+
+    def __ensure_loaded(self):
+        if self.__loader is not None:
+            self.__loader.wait()
+            self.__finish_loading()
+
+    def __reduced_image_to_tk(self):
+        image, scale = self.__loader.reduced
+        return self.image_to_tk(image, False, scale)
+
+    def save_session(self, path):
+        # returns (success, message), all history steps are saved in one file
+        self.__ensure_loaded()
+        start = time.perf_counter()
+        try:
+            save_session(path, self.__prev_images)
+        except OSError as error:
+            return False, str(error)
+        return True, f'Session saved in {(time.perf_counter() - start) * 1000:.0f} ms'
+
+    def open_session(self, path):
+        # returns (success, message), history steps other than the newest are read when they are needed
+        start = time.perf_counter()
+        try:
+            history = load_session(path)
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as error:
+            return False, f'Could not open session: {error}'
+        # image which is still loading would be opened after the session
+        self.__loader = None
+        self.__load_result = None
+        self.__add_document(os.path.basename(path), history)
+        return True, f'Session with {len(history)} steps opened in {(time.perf_counter() - start) * 1000:.0f} ms'
+
+    @property
+    def images(self):
+        # names of open images
+        return self.__workspace.names
+
+    @property
+    def active_image(self):
+        return self.__workspace.active
+
+    def switch_image(self, index):
+        # returns (success, message), other images stay compressed in memory (or on disk)
+        self.__ensure_loaded()
+        if index == self.__workspace.active:
+            return True, ''
+        start = time.perf_counter()
+        self.__set_history(self.__workspace.activate(index))
+        return True, f'Switched to {self.__workspace.names[index]} in {(time.perf_counter() - start) * 1000:.0f} ms'
+
+    def close_image(self):
+        # returns (success, message), the most recently used of other images becomes active
+        self.__ensure_loaded()
+        if len(self.__workspace) <= 1:
+            return False, 'The last image cannot be closed'
+        name = self.__workspace.names[self.__workspace.active]
+        self.__set_history(self.__workspace.close(self.__workspace.active))
+        return True, f'Closed {name}'
+
+    def __add_document(self, name, history):
+        self.__workspace.add(name, history)
+        self.__set_history(history)
+
+    def __set_history(self, history):
+        # the newest image of history becomes displayed image. Memory-mapped images are not copied, they are only read
+        self.__prev_images = history
+        self.__image = history[-1][0]
+        self.__set_manipulated(self.__image)
+        # buffers of the previous image have different shapes
+        self.__buffer_pool.clear()
+        self.__is_grayscale = history.records[-1].is_grayscale
+        self.__proxy = None
+        self.__render_cache.clear()
+        self.__histogram_cache.clear()
+        self.__pyramid_cache.clear()
+        self.__image_index = len(self.__prev_images) - 1
+        self.__manipulated_index = self.__image_index
+        self.__history_version += 1
+        self.__manipulated_scale = 100
+        self.__proxy_preview = None
+        self.__image_with_faces = self.__image
+
+    def __apply(self, name, accept, **parameters):
+        self.__ensure_loaded()
+        operation = operations.OPERATIONS[name]
+        is_grayscale = self.__prev_images.records[-1].is_grayscale
+        success, error_message = operation.validate(is_grayscale)
+        if not success:
+            return False, error_message
+        if accept and self.__preview is not None and self.__preview[:3] == (self.__history_version, name, parameters):
+            # accepted preview is copied out of the pool to history
+            duration = self.__preview[3]
+            with profiler.stage('copy preview'):
+                self.__set_manipulated(self.__manipulated_image.copy())
+            source_scale = 100
+        else:
+            if accept:
+                image, used_parameters, source_scale = self.__prev_images[-1][0], parameters, 100
+            else:
+                image, used_parameters, source_scale = self.__preview_input(operation, parameters)
+            start = time.perf_counter()
+            with profiler.stage(name):
+                result = operation(image, pool=self.__buffer_pool if not accept else operations.NO_POOL,
+                                   **used_parameters)
+            duration = time.perf_counter() - start
+            self.__set_manipulated(result, not accept)
+            if not accept and source_scale == 100:
+                self.__preview = (self.__history_version, name, parameters, duration)
+        self.__is_grayscale = operation.result_grayscale(is_grayscale)
+        self.__manipulated_index = None
+        self.__manipulated_scale = source_scale
+        self.__proxy_preview = (name, parameters) if source_scale != 100 else None
         if accept:
-            self.__prev_commands.append("Rotate by 90 degrees")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+            self.__prev_images.append(name, parameters, self.__manipulated_image, self.__is_grayscale, duration)
+            self.__manipulated_index = len(self.__prev_images) - 1
+            self.__render_cache.invalidate(self.__manipulated_index)
+            self.__histogram_cache.invalidate(self.__manipulated_index)
+            self.__pyramid_cache.invalidate(self.__manipulated_index)
+            self.__history_version += 1
+        return True, self.__proxy_message(source_scale)
+
+    def __proxy_input(self):
+        # last image downscaled to display scale, None when previews are computed in full resolution
+        if not self.__proxy_mode or self.__scale >= 100:
+            return None
+        key = (self.__history_version, self.__scale)
+        if self.__proxy is None or self.__proxy[0] != key:
+            image = self.__prev_images[-1][0]
+            width = max(int(image.shape[1] * self.__scale / 100), 1)
+            height = max(int(image.shape[0] * self.__scale / 100), 1)
+            self.__proxy = (key, cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA))
+        return self.__proxy[1]
+
+    def __preview_input(self, operation, parameters):
+        # returns (input image, parameters, scale of the result), kernel sizes are scaled for proxy image
+        proxy = self.__proxy_input()
+        if proxy is None:
+            return self.__prev_images[-1][0], parameters, 100
+        return proxy, operation.scale_parameters(parameters, self.__scale / 100), self.__scale
+
+    @staticmethod
+    def __proxy_message(source_scale):
+        return f'Proxy preview at {source_scale}% resolution' if source_scale != 100 else ''
+
+    def preview_job(self, name, *args):
+        self.__ensure_loaded()
+        # returns (success, error message, job); job computes preview without touching manager state, so it can be
+        # run on another thread and its result passed to set_preview
+        operation = operations.OPERATIONS[name]
+        is_grayscale = self.__prev_images.records[-1].is_grayscale
+        success, error_message = operation.validate(is_grayscale)
+        if not success:
+            return False, error_message, None
+        parameters = operation.bind(*args)
+        image, used_parameters, source_scale = self.__preview_input(operation, parameters)
+        result_grayscale = operation.result_grayscale(is_grayscale)
+        history_version = self.__history_version
+
+        pool = self.__buffer_pool
+
+        def job():
+            start = time.perf_counter()
+            with profiler.stage(f'{name} (background)'):
+                result = operation(image, pool=pool, **used_parameters)
+            return (result, result_grayscale, history_version, source_scale, (name, parameters),
+                    time.perf_counter() - start)
+        return True, '', job
+
+    def set_preview(self, job_result):
+        image, is_grayscale, history_version, source_scale, preview, duration = job_result
+        if history_version != self.__history_version:
+            self.__buffer_pool.release(image)
+            return False, ''
+        self.__set_manipulated(image, True)
+        self.__is_grayscale = is_grayscale
+        self.__manipulated_index = None
+        self.__manipulated_scale = source_scale
+        self.__proxy_preview = preview if source_scale != 100 else None
+        if source_scale == 100:
+            self.__preview = (history_version, *preview, duration)
+        return True, self.__proxy_message(source_scale)
+
+    def rotate_by_90(self, accept=False):
+        return self.__apply('rotate_by_90', accept)
 
     def rotate_by_180(self, accept=False):
-        self.__manipulated_image = cv2.rotate(self.__prev_images[-1][0], cv2.ROTATE_180)
-        if accept:
-            self.__prev_commands.append("Rotate by 180 degrees")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('rotate_by_180', accept)
 
     def rotate_by_270(self, accept=False):
-        self.__manipulated_image = cv2.rotate(self.__prev_images[-1][0], cv2.ROTATE_90_COUNTERCLOCKWISE)
-        if accept:
-            self.__prev_commands.append("Rotate by -90 degrees")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('rotate_by_270', accept)
 
-    def save_image(self, path: str, scale: bool, number=()):
+    def save_image(self, path: str, scale: bool, number=(), png_compression=DEFAULT_PNG_COMPRESSION,
+                   jpeg_quality=DEFAULT_JPEG_QUALITY):
+        # returns ExportJob writing the image in background, it has to be pumped until finished
+        self.__ensure_loaded()
         if number == ():
-            if scale:
-                cv2.imwrite(path, self.__scale_image(self.__manipulated_image))
-            else:
-
-                cv2.imwrite(path, self.__manipulated_image)
-
+            manipulated_image = self.__manipulated_image
+            if self.__proxy_preview is not None:
+                # proxy preview is only an approximation, saved image is computed in full resolution
+                name, parameters = self.__proxy_preview
+                manipulated_image = operations.apply(name, self.__prev_images[-1][0], parameters)
+            image = self.__scale_image(manipulated_image) if scale else manipulated_image
+            if image is self.__manipulated_image:
+                # preview buffer may be reused before the image is written
+                image = image.copy()
         else:
             image, gray = self.__prev_images[number[0]]
             if scale:
-                cv2.imwrite(path, self.__scale_image(image))
-            else:
-                cv2.imwrite(path, image)
+                image = self.__scale_image(image)
+        return ExportJob(*self.__export_executor(), [(path, lambda: image)], png_compression, jpeg_quality)
+
+    def export_history(self, directory, indices=None, extension='.png', png_compression=DEFAULT_PNG_COMPRESSION,
+                       jpeg_quality=DEFAULT_JPEG_QUALITY):
+        # returns ExportJob writing given (or all) history entries to the directory in full resolution. Images are
+        # recomputed only when the job asks for them and in ascending order, so replaying from keyframes is cheap.
+        self.__ensure_loaded()
+        if indices is None:
+            indices = range(len(self.__prev_images))
+        descriptions = self.__prev_images.descriptions
+        # export goes on when another image is activated in the meantime
+        history = self.__prev_images
+        items = [(os.path.join(directory, export_file_name(index, descriptions[index], extension)),
+                  lambda i=index: history[i][0]) for index in sorted(indices)]
+        return ExportJob(*self.__export_executor(), items, png_compression, jpeg_quality)
+
+    def __export_executor(self):
+        # (executor, number of workers) shared by all exports, threads are started on the first export
+        if self.__export_pool is None:
+            workers = os.cpu_count() or 1
+            self.__export_pool = (ThreadPoolExecutor(max_workers=workers), workers)
+        return self.__export_pool
+
+    def sweep(self, name, parameters, ranges):
+        # ranges maps names of swept parameters to (start, stop, number of steps), other parameters are taken from
+        # parameters dictionary; returns (success, error message, Sweep computing results in background)
+        self.__ensure_loaded()
+        operation = operations.OPERATIONS[name]
+        image, is_grayscale = self.__prev_images[-1]
+        success, error_message = operation.validate(is_grayscale)
+        if not success:
+            return False, error_message, None
+        values = {parameter: sweep_values(start, stop, steps, isinstance(parameters[parameter], int),
+                                          parameter in operation.kernel_parameters)
+                  for parameter, (start, stop, steps) in ranges.items()}
+        combinations = np.prod([len(parameter_values) for parameter_values in values.values()])
+        if combinations > MAX_COMBINATIONS:
+            return False, f'Too many combinations ({combinations}), maximum is {MAX_COMBINATIONS}', None
+        return True, f'Computing {combinations} previews', Sweep(image, is_grayscale, name, parameters, values)
+
+    def export_pipeline(self, path):
+        self.__ensure_loaded()
+        save_pipeline(path, steps_from_records(self.__prev_images.records))
+
+    def process_large_image(self, input_path, output_path, workers=None):
+        # accepted commands are applied tile by tile to an image which does not have to fit in memory
+        self.__ensure_loaded()
+        return TiledJob(steps_from_records(self.__prev_images.records), input_path, output_path, workers=workers)
+
+    def video_processor(self, path, output_path=None):
+        # accepted commands are applied to every frame of the video, returns (success, error message, processor)
+        self.__ensure_loaded()
+        try:
+            processor = VideoProcessor(path, steps_from_records(self.__prev_images.records), output_path=output_path)
+        except IOError as error:
+            return False, str(error), None
+        return True, f'Playing {path}', processor
+
+    def video_face_detector(self):
+        # haar detector used for video, None until the cascade is loaded
+        self.__haar_cascade.preload()
+        if self.__haar_cascade.state != face_detection.READY:
+            return None
+        return haar_detector(self.__haar_cascade.model)
 
     def median_blur(self, ksize, accept=False):
-        self.__manipulated_image = cv2.medianBlur(self.__prev_images[-1][0], ksize=ksize)
-        if accept:
-            self.__prev_commands.append(f"Median blur ksize={ksize}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('median_blur', accept, ksize=ksize)
 
     def gaussian_blur(self, ksize_x, ksize_y, accept=False):
-        self.__manipulated_image = cv2.GaussianBlur(self.__prev_images[-1][0], (ksize_x, ksize_y), 0)
-        if accept:
-            self.__prev_commands.append(f"Gaussian blur ksize={ksize_x, ksize_y}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('gaussian_blur', accept, ksize_x=ksize_x, ksize_y=ksize_y)
 
     def averaging_blur(self, ksize_x, ksize_y, accept=False):
-        self.__manipulated_image = cv2.blur(self.__prev_images[-1][0], (ksize_x, ksize_y))
-        if accept:
-            self.__prev_commands.append(f"Averaging blur ksize={ksize_x, ksize_y}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('averaging_blur', accept, ksize_x=ksize_x, ksize_y=ksize_y)
 
     def bilateral_filter(self, ksize, sigma, accept=False):
-        self.__manipulated_image = cv2.bilateralFilter(self.__prev_images[-1][0], ksize, sigma, sigma)
-        if accept:
-            self.__prev_commands.append(f"Bilateral filter ksize={ksize} sigma={sigma}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('bilateral_filter', accept, ksize=ksize, sigma=sigma)
 
     def global_threshold(self, maxval, threshold, accept=False):
-        ret, self.__manipulated_image = cv2.threshold(self.__prev_images[-1][0], threshold, maxval, cv2.THRESH_BINARY)
-        if accept:
-            self.__prev_commands.append(f"Global Threshold threshold={threshold} maxval={maxval}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('global_threshold', accept, maxval=maxval, threshold=threshold)
 
     def mean_threshold(self, maxval, block_size, c, accept=False):
-        if not self.__prev_images[-1][1]:
-            return False, 'Image must be in grayscale'
-        self.__manipulated_image = cv2.adaptiveThreshold(self.__prev_images[-1][0], maxval, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                                         cv2.THRESH_BINARY, block_size, c)
-        if accept:
-            self.__prev_commands.append(f"Global Threshold maxval={maxval} blocksize={block_size} C={c}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('mean_threshold', accept, maxval=maxval, block_size=block_size, c=c)
 
     def gaussian_threshold(self, maxval, block_size, c, accept=False):
-        if not self.__prev_images[-1][1]:
-            return False, 'Image must be in grayscale'
-        self.__manipulated_image = cv2.adaptiveThreshold(self.__prev_images[-1][0], maxval,
-                                                         cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                                         cv2.THRESH_BINARY, block_size, c)
-        if accept:
-            self.__prev_commands.append(f"Global Threshold maxval={maxval} blocksize={block_size} C={c}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('gaussian_threshold', accept, maxval=maxval, block_size=block_size, c=c)
 
     def sobel_x(self, delta, ksize, accept=False):
-        return self.sobel(delta, ksize, 1, 0, accept)
+        return self.__apply('sobel_x', accept, delta=delta, ksize=ksize)
 
     def sobel_y(self, delta, ksize, accept=False):
-        return self.sobel(delta, ksize, 0, 1, accept)
+        return self.__apply('sobel_y', accept, delta=delta, ksize=ksize)
 
     def sobel(self, delta, ksize, dx, dy, accept=False):
-        if not self.__prev_images[-1][1]:
-            return False, 'Image must be in grayscale'
-        self.__manipulated_image = cv2.Sobel(self.__prev_images[-1][0], cv2.CV_64F, dx, dy, ksize=ksize, delta=delta)
-        self.__manipulated_image = np.absolute(self.__manipulated_image)
-        self.__manipulated_image = np.uint8(self.__manipulated_image)
-        if accept:
-            self.__prev_commands.append(f"Sobel dx={dx} dy={dy} delta={delta} ksize={ksize}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('sobel', accept, delta=delta, ksize=ksize, dx=dx, dy=dy)
 
     def laplacian(self, delta, ksize, accept=False):
-        if not self.__prev_images[-1][1]:
-            return False, 'Image must be in grayscale'
-        self.__manipulated_image = cv2.Laplacian(self.__prev_images[-1][0], cv2.CV_64F, ksize=ksize, delta=delta)
-        self.__manipulated_image = np.absolute(self.__manipulated_image)
-        self.__manipulated_image = np.uint8(self.__manipulated_image)
-        if accept:
-            self.__prev_commands.append(f"Laplacian delta={delta} ksize={ksize}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('laplacian', accept, delta=delta, ksize=ksize)
 
     def canny(self, threshold1, threshold2, l2_gradient=False, accept=False):
-        if not self.__prev_images[-1][1]:
-            return False, 'Image must be in grayscale'
-        self.__manipulated_image = cv2.Canny(self.__prev_images[-1][0], threshold1, threshold2, l2_gradient)
-
-        if accept:
-            self.__prev_commands.append(
-                f"Canny threshold1={threshold1} threshold2={threshold2} l2_gradient={l2_gradient}")
-            self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-        return True, ''
+        return self.__apply('canny', accept, threshold1=threshold1, threshold2=threshold2, l2_gradient=l2_gradient)
 
     def to_grayscale(self, accept=False):
-        if self.__prev_images[-1][1]:
-            return False, "An Image is already in grayscale"
-        else:
-            self.__manipulated_image = cv2.cvtColor(self.__prev_images[-1][0], cv2.COLOR_BGR2GRAY)
-            if accept:
-                self.__prev_commands.append("Convert to grayscale")
-                self.__is_grayscale = True
-                self.__prev_images.append((self.__manipulated_image, self.__is_grayscale))
-            return True, ''
+        return self.__apply('to_grayscale', accept)
+
+    @property
+    def haar_cascade_state(self):
+        return self.__haar_cascade.state
+
+    @property
+    def shape_predictor_state(self):
+        return self.__dlib_models.state
+
+    def load_haar_cascade(self):
+        self.__haar_cascade.preload()
+
+    def load_shape_predictor(self):
+        self.__dlib_models.preload()
 
-    def haar_face_detection(self, scale_factor, min_neighbours, thickness=2, color=(0, 255, 0)):
-        if not self.__haar_cascade_loaded:
+    def haar_face_detection(self, scale_factor, min_neighbours, thickness=2, color=(0, 255, 0), working_scale=100,
+                            min_size=0, max_size=0, region=None):
+        self.__ensure_loaded()
+        self.__haar_cascade.preload()
+        if self.__haar_cascade.state == face_detection.FAILED:
             return False, 'Haar cascade could not be properly opened!'
+        elif self.__haar_cascade.state != face_detection.READY:
+            return False, 'Haar cascade is still loading'
         elif not self.__prev_images[-1][1]:
             return False, "Image must be in grayscale"
+        elif max_size and min_size > max_size:
+            return False, 'Minimal face size is bigger than maximal'
         else:
-            detected_faces = self.__haar_cascade.detectMultiScale(self.__prev_images[-1][0], scale_factor, min_neighbours)
-            self.__image_with_faces = self.__image.copy()
-            for (x, y, w, h) in detected_faces:
-                cv2.rectangle(self.__image_with_faces, (x, y), (x + w, y + h), color, thickness=thickness)
-            return True, f'Detected {len(detected_faces)} faces'
+            gray_image = self.__prev_images[-1][0]
+            with profiler.stage('digest'):
+                key = (face_detection.image_digest(gray_image), 'haar', scale_factor, min_neighbours, working_scale,
+                       min_size, max_size, region and tuple(region))
+            detected_faces = self.__detection_cache.get(key)
+            cached = detected_faces is not None
+            if not cached:
+                with profiler.stage('haar detection'):
+                    detected_faces = face_detection.haar_detect(self.__haar_cascade.model, gray_image, scale_factor,
+                                                                min_neighbours, working_scale, min_size, max_size,
+                                                                region)
+                self.__detection_cache.put(key, detected_faces, detected_faces.nbytes)
+            with profiler.stage('draw'):
+                self.__image_with_faces = self.__image.copy()
+                face_detection.draw_haar_faces(self.__image_with_faces, detected_faces, thickness, color)
+            return True, f'Detected {len(detected_faces)} faces{" (cached)" if cached else ""}'
 
     def dlib_face_shape_prediction(self, eye_color=(0, 255, 0), mouth_color=(255, 0, 0), face_color=(0, 0, 255), frame_color=(0, 255, 255), thickness=2):
-        if not self.__shape_predictor_loaded:
+        self.__ensure_loaded()
+        self.__dlib_models.preload()
+        if self.__dlib_models.state == face_detection.FAILED:
             return False, 'Dlib shape predictor could not be opened'
+        elif self.__dlib_models.state != face_detection.READY:
+            return False, 'Dlib shape predictor is still loading'
         elif not self.__prev_images[-1][1]:
             return False, "Image must be in grayscale"
         else:
-            detected_faces = self.__detector(self.__prev_images[-1][0])
-            self.__image_with_faces = self.__image.copy()
-
-            for face in detected_faces:
-                x1 = face.left()
-                y1 = face.top()
-                x2 = face.right()
-                y2 = face.bottom()
-                cv2.rectangle(self.__image_with_faces, (x1, y1), (x2, y2), frame_color, thickness=thickness)
-
-                landmarks = self.__shape_predictor(self.__prev_images[-1][0], face)
-
-                for p in range(0, 36):
-                    # -1 means it will fill the circle
-                    centre = landmarks.part(p).x, landmarks.part(p).y
-                    cv2.circle(self.__image_with_faces, centre, thickness, face_color, -1)
-
-                for p in range(36, 48):
-                    centre = landmarks.part(p).x, landmarks.part(p).y
-                    cv2.circle(self.__image_with_faces, centre, thickness, eye_color, -1)
-
-                for p in range(48, 68):
-                    centre = landmarks.part(p).x, landmarks.part(p).y
-                    cv2.circle(self.__image_with_faces, centre, thickness, mouth_color, -1)
-
-            return True, f'Detected {len(detected_faces)} faces'
+            gray_image = self.__prev_images[-1][0]
+            with profiler.stage('digest'):
+                key = (face_detection.image_digest(gray_image), 'dlib')
+            detections = self.__detection_cache.get(key)
+            cached = detections is not None
+            if not cached:
+                detector, shape_predictor = self.__dlib_models.model
+                with profiler.stage('dlib detection'):
+                    detections = face_detection.dlib_detect(detector, shape_predictor, gray_image)
+                self.__detection_cache.put(key, detections, detections[0].nbytes + detections[1].nbytes)
+            boxes, landmarks = detections
+            with profiler.stage('draw'):
+                self.__image_with_faces = self.__image.copy()
+                face_detection.draw_dlib_faces(self.__image_with_faces, boxes, landmarks, eye_color, mouth_color,
+                                               face_color, frame_color, thickness)
+            return True, f'Detected {len(boxes)} faces{" (cached)" if cached else ""}'
 
     def undo(self):
+        self.__ensure_loaded()
         if len(self.__prev_images) <= 1:
             return False, 'No actions to undo'
         else:
-            self.__image = self.__prev_images[-2][0]
-            self.__manipulated_image = self.__image.copy()
-            self.__image_with_faces = self.__image.copy()
-            self.__is_grayscale = self.__prev_images[-2][1]
             self.__prev_images.pop()
-            self.__prev_commands.pop()
-            assert (len(self.__prev_commands) == len(self.__prev_images))
+            self.__render_cache.invalidate(len(self.__prev_images))
+            self.__histogram_cache.invalidate(len(self.__prev_images))
+            self.__pyramid_cache.invalidate(len(self.__prev_images))
+            self.__image, self.__is_grayscale = self.__prev_images[-1]
+            self.__image_index = len(self.__prev_images) - 1
+            self.__manipulated_index = self.__image_index
+            self.__history_version += 1
+            self.__manipulated_scale = 100
+            self.__proxy_preview = None
+            self.__set_manipulated(self.__image.copy())
+            self.__image_with_faces = self.__image.copy()
             assert (len(self.__prev_images) >= 1)
             return True, ''
 
-    def __display_histogram(self, image, is_gray):
-        plt.figure()
-        plt.title('Histogram')
-        plt.xlabel('pixel value')
-        plt.ylabel('number of pixels')
-        if is_gray:
-            histogram = cv2.calcHist([image], [0], None, [256], [0, 256])
-            plt.plot(histogram)
-            plt.xlim([0, 256])
-        else:
-            colors = ['b', 'g', 'r']
-            for i, color in enumerate(colors):
-                histogram = cv2.calcHist([image], [i], None, [256], [0, 256])
-                plt.plot(histogram, color=color)
-        plt.xlim([0, 256])
-        plt.show(block=[0, 256])
-
-    def display_histogram(self, number=None):
+    def histogram(self, number=None):
+        self.__ensure_loaded()
+        # histogram of history entry or of manipulated image (None), array (channels, 256)
+        if number is None and self.__manipulated_index is not None:
+            number = self.__manipulated_index
         if number is None:
-            self.__display_histogram(self.__manipulated_image, self.__is_grayscale)
-        else:
-            self.__display_histogram(self.__prev_images[number][0], self.__prev_images[number][1])
+            if self.__preview_histogram is None or self.__preview_histogram[0] is not self.__manipulated_image:
+                with profiler.stage('histogram'):
+                    histogram = compute_histogram(self.__manipulated_image, self.__is_grayscale)
+                self.__preview_histogram = (self.__manipulated_image, histogram)
+            return self.__preview_histogram[1]
+        number = number % len(self.__prev_images)
+        histogram = self.__histogram_cache.get((number,))
+        if histogram is None:
+            with profiler.stage('histogram'):
+                histogram = compute_histogram(*self.__prev_images[number])
+            self.__histogram_cache.put((number,), histogram, histogram.nbytes)
+        return histogram
 
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import numpy as np
+import face_detection
+from batch import list_images
+from pipeline import load_pipeline, run_pipeline
+
+# state of the worker process set by initializer
+_steps = None
+_dlib_models = None
+
+
+def _init_worker(steps, shape_predictor_path):
+    global _steps, _dlib_models
+    cv2.setNumThreads(1)
+    _steps = steps
+    _dlib_models = face_detection.load_dlib_models(shape_predictor_path)
+
+
+def _detect_landmarks(path):
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f'Could not read {path}')
+    image, is_grayscale = run_pipeline(image, _steps)
+    if not is_grayscale:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return face_detection.dlib_detect(_dlib_models[0], _dlib_models[1], image)
+
+
+def extract_landmarks(image_dir, steps, workers=None, shape_predictor_path=face_detection.SHAPE_PREDICTOR_PATH):
+    # returns ({image name: (boxes (N, 4), landmarks (N, 68, 2))}, {image name: error message})
+    results = {}
+    errors = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(steps, shape_predictor_path)) as executor:
+        futures = {executor.submit(_detect_landmarks, os.path.join(image_dir, name)): name
+                   for name in list_images(image_dir)}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as error:
+                errors[futures[future]] = str(error)
+    return results, errors
+
+
+# .json maps image names to lists of {"box": [x, y, w, h], "landmarks": [[x, y], ...]}. .npz contains names of images,
+# boxes (M, 4) and landmarks (M, 68, 2) of all M faces and image_index (M,) pointing every face to its image name.
+def save_landmarks(path, results):
+    names = sorted(results)
+    if path.lower().endswith('.json'):
+        with open(path, 'w') as file:
+            json.dump({name: [{'box': box, 'landmarks': points}
+                              for box, points in zip(results[name][0].tolist(), results[name][1].tolist())]
+                       for name in names}, file)
+        return
+    boxes = [results[name][0] for name in names]
+    np.savez_compressed(path, names=np.array(names, dtype=str),
+                        image_index=np.repeat(np.arange(len(names)), [len(box) for box in boxes]),
+                        boxes=np.concatenate(boxes) if boxes else np.empty((0, 4), dtype=int),
+                        landmarks=np.concatenate([results[name][1] for name in names]) if names
+                        else np.empty((0, face_detection.LANDMARK_COUNT, 2), dtype=int))
+
+
+def load_landmarks(path):
+    # returns {image name: (boxes (N, 4), landmarks (N, 68, 2))} saved by save_landmarks
+    if path.lower().endswith('.json'):
+        with open(path) as file:
+            data = json.load(file)
+        return {name: (np.array([face['box'] for face in faces], dtype=int).reshape(-1, 4),
+                       np.array([face['landmarks'] for face in faces],
+                                dtype=int).reshape(-1, face_detection.LANDMARK_COUNT, 2))
+                for name, faces in data.items()}
+    with np.load(path) as data:
+        image_index = data['image_index']
+        return {str(name): (data['boxes'][image_index == i], data['landmarks'][image_index == i])
+                for i, name in enumerate(data['names'])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Detect faces with dlib and save their 68 landmarks for every image '
+                                                 'in a directory')
+    parser.add_argument('image_dir')
+    parser.add_argument('output', help='.npz or .json file')
+    parser.add_argument('-p', '--pipeline', help='preprocessing pipeline file (File > Export Pipeline)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--shape-predictor', default=face_detection.SHAPE_PREDICTOR_PATH)
+    args = parser.parse_args()
+
+    steps = load_pipeline(args.pipeline) if args.pipeline else []
+    start = time.perf_counter()
+    results, errors = extract_landmarks(args.image_dir, steps, args.workers, args.shape_predictor)
+    save_landmarks(args.output, results)
+    for name, message in sorted(errors.items()):
+        print(f'{name}: error: {message}')
+    print(f'{sum(len(boxes) for boxes, _ in results.values())} faces in {len(results)} images, '
+          f'{time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+import re
+import threading
+import time
+import cv2
+import numpy as np
+
+# jpeg decoder can skip DCT coefficients, so decoding in reduced resolution is several times faster
+REDUCED_EXTENSIONS = ('.jpg', '.jpeg')
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# raw files contain only 8-bit pixels, their size is given in the name, e.g. scan_4000x3000x3.raw
+RAW_NAME = re.compile(r'(\d+)x(\d+)(?:x([13]))?\.raw$', re.IGNORECASE)
+
+
+def is_memory_mappable(path):
+    return path.lower().endswith('.npy') or RAW_NAME.search(os.path.basename(path)) is not None
+
+
+def map_image(path):
+    # opens .npy or raw file as read-only memory map, nothing is read until pixels are used
+    if path.lower().endswith('.npy'):
+        image = np.load(path, mmap_mode='r')
+    else:
+        width, height, channels = RAW_NAME.search(os.path.basename(path)).groups()
+        shape = (int(height), int(width)) if channels in (None, '1') else (int(height), int(width), 3)
+        image = np.memmap(path, np.uint8, 'r', shape=shape)
+    if image.dtype != np.uint8 or not (image.ndim == 2 or image.ndim == 3 and image.shape[2] == 3):
+        raise ValueError(f'{path} must contain 8-bit grayscale or BGR image')
+    return image
+
+
+def read_reduced(path, display_scale):
+    # returns (image decoded in reduced resolution, its scale in percents) or None when it would not be faster
+    if not path.lower().endswith(REDUCED_EXTENSIONS):
+        return None
+    for factor, flag in REDUCED_FLAGS:
+        if display_scale * factor <= 100:
+            image = cv2.imread(path, flag)
+            return (image, 100 / factor) if image is not None else None
+    return None
+
+
+class ImageLoader:
+    # Opens image so that something can be shown as soon as possible. Memory-mappable files are only mapped,
+    # big jpegs are decoded in reduced resolution (enough for display scale) and in full resolution on a background
+    # thread, other files are decoded at once.
+    def __init__(self, path, display_scale=100):
+        self.path = path
+        self.start = time.perf_counter()
+        # (image, scale in percents) shown until full resolution image is loaded
+        self.reduced = None
+        self.image = None
+        self.error = None
+        self.full_time = None
+        self.__thread = None
+
+        if is_memory_mappable(path):
+            self.image = map_image(path)
+        else:
+            self.reduced = read_reduced(path, display_scale)
+            if self.reduced is None:
+                self.__load()
+                if self.error is not None:
+                    raise self.error
+            else:
+                self.__thread = threading.Thread(target=self.__load, daemon=True)
+                self.__thread.start()
+        if self.image is not None:
+            self.full_time = time.perf_counter() - self.start
+
+    @property
+    def finished(self):
+        return self.image is not None or self.error is not None
+
+    def wait(self):
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __load(self):
+        image = cv2.imread(self.path, cv2.IMREAD_COLOR)
+        if image is None:
+            self.error = IOError(f'Could not read {self.path}')
+            return
+        self.full_time = time.perf_counter() - self.start
+        self.image = image
@@ -0,0 +1,189 @@
+import inspect
+import cv2
+import numpy as np
+from buffer_pool import NO_POOL
+
+
+class Operation:
+    def __init__(self, function, description, requires_grayscale=False, requires_color=False, to_grayscale=False,
+                 expensive=False, kernel_parameters=None, halo=0, tileable=True):
+        self.function = function
+        # description is formatted with operation parameters
+        self.description = description
+        self.requires_grayscale = requires_grayscale
+        self.requires_color = requires_color
+        self.to_grayscale = to_grayscale
+        # expensive operations are always kept as keyframes in history
+        self.expensive = expensive
+        # odd kernel sizes (parameter name -> minimal value) which are scaled together with the image
+        self.kernel_parameters = kernel_parameters if kernel_parameters is not None else {}
+        # neighbourhood (in pixels) needed besides kernel parameters to compute one pixel of the result
+        self.halo = halo
+        # result of operations which are not tileable depends on the whole image, they can't be computed in tiles
+        self.tileable = tileable
+
+    def __call__(self, image, pool=NO_POOL, **parameters):
+        # result (and temporary arrays) are taken from the pool, result belongs to the caller
+        return self.function(image, pool=pool, **parameters)
+
+    def bind(self, *args, **kwargs):
+        # converts positional arguments (as passed to ImageManager methods) to parameters dictionary
+        signature = inspect.signature(self.function)
+        arguments = signature.bind(None, *args, **kwargs)
+        arguments.apply_defaults()
+        parameters = {name: value for name, value in arguments.arguments.items()
+                      if signature.parameters[name].kind != inspect.Parameter.KEYWORD_ONLY}
+        parameters.pop(next(iter(parameters)))
+        return parameters
+
+    def scale_parameters(self, parameters, factor):
+        # parameters for image resized by factor, so the result looks like the resized result of the original image
+        scaled = dict(parameters)
+        for name, minimum in self.kernel_parameters.items():
+            size = max(int(round(parameters[name] * factor)), minimum)
+            scaled[name] = size if size % 2 == 1 else size + 1
+        return scaled
+
+    def halo_size(self, parameters):
+        # width of overlap needed when image is processed in tiles, so results of tiles match the whole image
+        size = self.halo
+        if self.kernel_parameters:
+            size = max(size, max(parameters[name] for name in self.kernel_parameters) // 2, 1)
+        return size
+
+    def describe(self, parameters):
+        return self.description.format(**parameters)
+
+    def validate(self, is_grayscale):
+        if self.requires_grayscale and not is_grayscale:
+            return False, 'Image must be in grayscale'
+        if self.requires_color and is_grayscale:
+            return False, 'An Image is already in grayscale'
+        return True, ''
+
+    def result_grayscale(self, is_grayscale):
+        return is_grayscale or self.to_grayscale
+
+
+# Every operation writes its result to an array acquired from the pool (opencv functions write to given dst array
+# when it has the right shape and type).
+
+def rotated_shape(shape):
+    return (shape[1], shape[0]) + shape[2:]
+
+
+def rotate_by_90(image, *, pool=NO_POOL):
+    return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE, dst=pool.acquire(rotated_shape(image.shape)))
+
+
+def rotate_by_180(image, *, pool=NO_POOL):
+    return cv2.rotate(image, cv2.ROTATE_180, dst=pool.acquire(image.shape))
+
+
+def rotate_by_270(image, *, pool=NO_POOL):
+    return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=pool.acquire(rotated_shape(image.shape)))
+
+
+def to_grayscale(image, *, pool=NO_POOL):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=pool.acquire(image.shape[:2]))
+
+
+def median_blur(image, ksize, *, pool=NO_POOL):
+    return cv2.medianBlur(image, ksize=ksize, dst=pool.acquire(image.shape))
+
+
+def gaussian_blur(image, ksize_x, ksize_y, *, pool=NO_POOL):
+    return cv2.GaussianBlur(image, (ksize_x, ksize_y), 0, dst=pool.acquire(image.shape))
+
+
+def averaging_blur(image, ksize_x, ksize_y, *, pool=NO_POOL):
+    return cv2.blur(image, (ksize_x, ksize_y), dst=pool.acquire(image.shape))
+
+
+def bilateral_filter(image, ksize, sigma, *, pool=NO_POOL):
+    return cv2.bilateralFilter(image, ksize, sigma, sigma, dst=pool.acquire(image.shape))
+
+
+def global_threshold(image, maxval, threshold, *, pool=NO_POOL):
+    ret, result = cv2.threshold(image, threshold, maxval, cv2.THRESH_BINARY, dst=pool.acquire(image.shape))
+    return result
+
+
+def mean_threshold(image, maxval, block_size, c, *, pool=NO_POOL):
+    return cv2.adaptiveThreshold(image, maxval, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size, c,
+                                 dst=pool.acquire(image.shape))
+
+
+def gaussian_threshold(image, maxval, block_size, c, *, pool=NO_POOL):
+    return cv2.adaptiveThreshold(image, maxval, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c,
+                                 dst=pool.acquire(image.shape))
+
+
+def absolute_to_uint8(gradient, pool):
+    # the same as np.uint8(np.absolute(gradient)) without temporary arrays, gradient is overwritten
+    np.absolute(gradient, out=gradient)
+    result = pool.acquire(gradient.shape)
+    np.copyto(result, gradient, casting='unsafe')
+    pool.release(gradient)
+    return result
+
+
+def sobel(image, delta, ksize, dx, dy, *, pool=NO_POOL):
+    gradient = cv2.Sobel(image, cv2.CV_64F, dx, dy, dst=pool.acquire(image.shape, np.float64), ksize=ksize,
+                         delta=delta)
+    return absolute_to_uint8(gradient, pool)
+
+
+def sobel_x(image, delta, ksize, *, pool=NO_POOL):
+    return sobel(image, delta, ksize, 1, 0, pool=pool)
+
+
+def sobel_y(image, delta, ksize, *, pool=NO_POOL):
+    return sobel(image, delta, ksize, 0, 1, pool=pool)
+
+
+def laplacian(image, delta, ksize, *, pool=NO_POOL):
+    gradient = cv2.Laplacian(image, cv2.CV_64F, dst=pool.acquire(image.shape, np.float64), ksize=ksize, delta=delta)
+    return absolute_to_uint8(gradient, pool)
+
+
+def canny(image, threshold1, threshold2, l2_gradient=False, *, pool=NO_POOL):
+    return cv2.Canny(image, threshold1, threshold2, edges=pool.acquire(image.shape[:2]), L2gradient=l2_gradient)
+
+
+# names are the same as names of ImageManager methods
+OPERATIONS = {
+    'rotate_by_90': Operation(rotate_by_90, 'Rotate by 90 degrees'),
+    'rotate_by_180': Operation(rotate_by_180, 'Rotate by 180 degrees'),
+    'rotate_by_270': Operation(rotate_by_270, 'Rotate by -90 degrees'),
+    'to_grayscale': Operation(to_grayscale, 'Convert to grayscale', requires_color=True, to_grayscale=True),
+    'median_blur': Operation(median_blur, 'Median blur ksize={ksize}', kernel_parameters={'ksize': 3}),
+    'gaussian_blur': Operation(gaussian_blur, 'Gaussian blur ksize=({ksize_x}, {ksize_y})',
+                               kernel_parameters={'ksize_x': 1, 'ksize_y': 1}),
+    'averaging_blur': Operation(averaging_blur, 'Averaging blur ksize=({ksize_x}, {ksize_y})',
+                                kernel_parameters={'ksize_x': 1, 'ksize_y': 1}),
+    'bilateral_filter': Operation(bilateral_filter, 'Bilateral filter ksize={ksize} sigma={sigma}', expensive=True,
+                                  kernel_parameters={'ksize': 1}),
+    'global_threshold': Operation(global_threshold, 'Global Threshold threshold={threshold} maxval={maxval}'),
+    'mean_threshold': Operation(mean_threshold, 'Adaptive Mean Threshold maxval={maxval} blocksize={block_size} '
+                                                'C={c}', requires_grayscale=True,
+                                kernel_parameters={'block_size': 3}),
+    'gaussian_threshold': Operation(gaussian_threshold, 'Adaptive Gaussian Threshold maxval={maxval} '
+                                                        'blocksize={block_size} C={c}', requires_grayscale=True,
+                                    kernel_parameters={'block_size': 3}),
+    'sobel': Operation(sobel, 'Sobel dx={dx} dy={dy} delta={delta} ksize={ksize}', requires_grayscale=True,
+                       kernel_parameters={'ksize': 1}),
+    'sobel_x': Operation(sobel_x, 'Sobel dx=1 dy=0 delta={delta} ksize={ksize}', requires_grayscale=True,
+                         kernel_parameters={'ksize': 1}),
+    'sobel_y': Operation(sobel_y, 'Sobel dx=0 dy=1 delta={delta} ksize={ksize}', requires_grayscale=True,
+                         kernel_parameters={'ksize': 1}),
+    'laplacian': Operation(laplacian, 'Laplacian delta={delta} ksize={ksize}', requires_grayscale=True,
+                           kernel_parameters={'ksize': 1}),
+    # hysteresis of canny follows edges arbitrarily far, so no halo would make tiles match the whole image
+    'canny': Operation(canny, 'Canny threshold1={threshold1} threshold2={threshold2} l2_gradient={l2_gradient}',
+                       requires_grayscale=True, tileable=False),
+}
+
+
+def apply(name, image, parameters):
+    return OPERATIONS[name](image, **parameters)
@@ -4,6 +4,7 @@ from tkinter import filedialog as fd
 from tkinter.scrolledtext import ScrolledText
 from PIL import Image
 from PIL import ImageTk
+from face_detection import NOT_LOADED, READY
 
 
 class LabeledScale(ttk.Frame):
@@ -25,6 +26,8 @@ class LabeledScale(ttk.Frame):
         if variable is not None:
             self.__text.set(variable.get())
             self.__slider.set(variable.get())
+            # label follows the variable also when it is set from code
+            variable.trace_add('write', lambda *args: self.__update_label(None))
 
     def __update_label(self, scale):
         if self.__variable is None:
@@ -58,6 +61,11 @@ class PreviewAcceptButtons(ttk.Frame):
         self.preview_button.grid(row=0, column=0, sticky=(W, E))
         self.accept_button = ttk.Button(self, text='Accept')
         self.accept_button.grid(row=0, column=1, sticky=(W, E))
+        self.live_preview = BooleanVar()
+        live_preview_lch = LabeledCheckButton(self, 'Live preview:', self.live_preview)
+        live_preview_lch.grid(row=1, column=0, sticky=W, pady=5)
+        self.sweep_button = ttk.Button(self, text='Sweep...')
+        self.sweep_button.grid(row=1, column=1, sticky=(W, E), pady=5)
 
 
 class LabeledSpinBox(ttk.Frame):
@@ -107,6 +115,63 @@ class ParametersMenu(ttk.Frame):
         self._buttons = PreviewAcceptButtons(self)
         self._buttons.grid(row=3, column=0, sticky=(W, E), pady=10, padx=5)
 
+        self._live_callback_function = None
+        self._sweep_callback_function = None
+        self._watch(self._buttons.live_preview)
+
+    @property
+    def callback(self):
+        return self._callback_function
+
+    @callback.setter
+    def callback(self, callback_function):
+        self._callback_function = callback_function
+        self._buttons.preview_button.configure(command=lambda: self._callback_function(*self._arguments()))
+        self._buttons.accept_button.configure(command=lambda: self._callback_function(*self._arguments(), True))
+
+    # called with the same arguments as callback (without accept) every time a parameter changes in live preview mode
+    @property
+    def live_callback(self):
+        return self._live_callback_function
+
+    @live_callback.setter
+    def live_callback(self, live_callback_function):
+        self._live_callback_function = live_callback_function
+
+    # called with the same arguments as callback (without accept) when user wants to sweep parameters
+    @property
+    def sweep_callback(self):
+        return self._sweep_callback_function
+
+    @sweep_callback.setter
+    def sweep_callback(self, sweep_callback_function):
+        self._sweep_callback_function = sweep_callback_function
+        self._buttons.sweep_button.configure(command=lambda: self._sweep_callback_function(*self._arguments()))
+
+    # sets parameters in the same order as they are passed to callback
+    def set_arguments(self, *args):
+        self._set_arguments(*args)
+
+    def _arguments(self):
+        return ()
+
+    def _set_arguments(self, *args):
+        pass
+
+    def _watch(self, *variables):
+        for variable in variables:
+            variable.trace_add('write', self.__parameter_changed)
+
+    def __parameter_changed(self, *args):
+        if not self._buttons.live_preview.get() or self._live_callback_function is None:
+            return
+        try:
+            arguments = self._arguments()
+        except (ValueError, TclError):
+            # user is still typing the value
+            return
+        self._live_callback_function(*arguments)
+
 
 class FaceDetectionMenu(ttk.Frame):
     def __init__(self, master=None, name='', **kw):
@@ -130,6 +195,21 @@ class FaceDetectionMenu(ttk.Frame):
         self._button = ttk.Button(self, text='Apply')
         self._button.grid(row=3, column=0, sticky=(W, E), pady=10)
 
+        self.__state_label = ttk.Label(self, anchor='center')
+        self.__state_label.grid(row=4, column=0, sticky=(W, E))
+        self.model_state = NOT_LOADED
+
+    @property
+    def model_state(self):
+        return self.__model_state
+
+    @model_state.setter
+    def model_state(self, state):
+        # detection is possible only with loaded model
+        self.__model_state = state
+        self.__state_label.configure(text=f'Model: {state}')
+        self._button.state(['!disabled'] if state == READY else ['disabled'])
+
 
 class CannyMenu(ParametersMenu):
     def __init__(self, master=None, **kw):
@@ -147,20 +227,15 @@ class CannyMenu(ParametersMenu):
         l2_gradient_lch = LabeledCheckButton(self._main_frame, 'L2gradient:', self.__l2_gradient)
         l2_gradient_lch.grid(row=3, column=0, sticky=(W, E), pady=10)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__thresh1, self.__thresh2, self.__l2_gradient)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(self.__thresh1.get(),
-                                                                                       self.__thresh2.get(),
-                                                                                       self.__l2_gradient.get()))
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(self.__thresh1.get(),
-                                                                                      self.__thresh2.get(),
-                                                                                      self.__l2_gradient.get(),
-                                                                                      True))
+    def _arguments(self):
+        return self.__thresh1.get(), self.__thresh2.get(), self.__l2_gradient.get()
+
+    def _set_arguments(self, threshold1, threshold2, l2_gradient=False):
+        self.__thresh1.set(threshold1)
+        self.__thresh2.set(threshold2)
+        self.__l2_gradient.set(l2_gradient)
 
 
 class MedianBlur(ParametersMenu):
@@ -171,15 +246,13 @@ class MedianBlur(ParametersMenu):
         ksize_lsb = LabeledSpinBox(self._main_frame, 'Ksize:', self.__ksize, [3, 5, 7, 9, 11])
         ksize_lsb.grid(row=0, column=0, sticky=(W, E), pady=10)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__ksize)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(int(self.__ksize.get())))
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(int(self.__ksize.get()), True))
+    def _arguments(self):
+        return int(self.__ksize.get()),
+
+    def _set_arguments(self, ksize):
+        self.__ksize.set(ksize)
 
 
 class GeneralBlurMenu(ParametersMenu):
@@ -193,18 +266,14 @@ class GeneralBlurMenu(ParametersMenu):
         ksize_y_lsb = LabeledSpinBox(self._main_frame, 'Ksize y:', self.__ksize_y, [3, 5, 7, 9, 11])
         ksize_y_lsb.grid(row=1, column=0, sticky=(W, E), pady=10)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__ksize_x, self.__ksize_y)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(int(self.__ksize_x.get()),
-                                                                                       int(self.__ksize_y.get())))
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(int(self.__ksize_x.get()),
-                                                                                      int(self.__ksize_y.get()),
-                                                                                      True))
+    def _arguments(self):
+        return int(self.__ksize_x.get()), int(self.__ksize_y.get())
+
+    def _set_arguments(self, ksize_x, ksize_y):
+        self.__ksize_x.set(ksize_x)
+        self.__ksize_y.set(ksize_y)
 
 
 class BilateralFilterMenu(ParametersMenu):
@@ -218,18 +287,14 @@ class BilateralFilterMenu(ParametersMenu):
         sigma_ls = LabeledScale(self._main_frame, 'Sigma:', 1, 200, self.__sigma, True)
         sigma_ls.grid(row=1, column=0, sticky=(W, E), pady=10)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__ksize, self.__sigma)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(int(self.__ksize.get()),
-                                                                                       round(self.__sigma.get(), 2)))
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(int(self.__ksize.get()),
-                                                                                      round(self.__sigma.get(), 2),
-                                                                                      True))
+    def _arguments(self):
+        return int(self.__ksize.get()), round(self.__sigma.get(), 2)
+
+    def _set_arguments(self, ksize, sigma):
+        self.__ksize.set(ksize)
+        self.__sigma.set(sigma)
 
 
 class GlobalThresholdMenu(ParametersMenu):
@@ -246,19 +311,14 @@ class GlobalThresholdMenu(ParametersMenu):
         thresh_ls.grid(row=1, column=0, sticky=(E, W), pady=10)
         thresh_ls.set(150)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__max_val, self.__thresh)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(self.__max_val.get(),
-                                                                                       self.__thresh.get()))
+    def _arguments(self):
+        return self.__max_val.get(), self.__thresh.get()
 
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(self.__max_val.get(),
-                                                                                      self.__thresh.get(),
-                                                                                      True))
+    def _set_arguments(self, max_val, threshold):
+        self.__max_val.set(max_val)
+        self.__thresh.set(threshold)
 
 
 class AdaptiveThresholdMenu(ParametersMenu):
@@ -279,21 +339,15 @@ class AdaptiveThresholdMenu(ParametersMenu):
         block_size_lsb = LabeledSpinBox(self._main_frame, 'Block size:', self.__block_size, [3, 5, 7, 9, 11])
         block_size_lsb.grid(row=2, column=0, sticky=(W, E), pady=10)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__max_val, self.__c, self.__block_size)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(self.__max_val.get(),
-                                                                                       int(self.__block_size.get()),
-                                                                                       self.__c.get()))
+    def _arguments(self):
+        return self.__max_val.get(), int(self.__block_size.get()), self.__c.get()
 
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(self.__max_val.get(),
-                                                                                      int(self.__block_size.get()),
-                                                                                      self.__c.get(),
-                                                                                      True))
+    def _set_arguments(self, max_val, block_size, c):
+        self.__max_val.set(max_val)
+        self.__block_size.set(block_size)
+        self.__c.set(c)
 
 
 class GradientMenu(ParametersMenu):
@@ -308,19 +362,14 @@ class GradientMenu(ParametersMenu):
         ksize_lsb = LabeledSpinBox(self._main_frame, 'Ksize:', self.__ksize, [1, 3, 5, 7, 9, 11])
         ksize_lsb.grid(row=1, column=0, sticky=(W, E), pady=10)
 
-    @property
-    def callback(self):
-        return self._callback_function
+        self._watch(self.__delta, self.__ksize)
 
-    @callback.setter
-    def callback(self, callback_function):
-        self._callback_function = callback_function
-        self._buttons.preview_button.configure(command=lambda: self._callback_function(self.__delta.get(),
-                                                                                       int(self.__ksize.get())))
+    def _arguments(self):
+        return self.__delta.get(), int(self.__ksize.get())
 
-        self._buttons.accept_button.configure(command=lambda: self._callback_function(self.__delta.get(),
-                                                                                      int(self.__ksize.get()),
-                                                                                      True))
+    def _set_arguments(self, delta, ksize):
+        self.__delta.set(delta)
+        self.__ksize.set(ksize)
 
 
 class HaarCascadeMenu(FaceDetectionMenu):
@@ -353,6 +402,52 @@ class HaarCascadeMenu(FaceDetectionMenu):
                                    self._color_types, validate_function=always_reject)
         color_lbx.grid(row=3, column=0, sticky=(W, E), pady=10)
 
+        # detection on smaller image is much faster and usually finds the same faces
+        self.__working_scale = IntVar()
+        working_scale_ls = LabeledScale(self._main_frame, 'Working scale (%):', 10, 100, self.__working_scale)
+        working_scale_ls.set(100)
+        working_scale_ls.grid(row=4, column=0, sticky=(W, E), pady=10)
+
+        # face sizes in pixels of the original image, 0 means no limit
+        self.__min_size = IntVar()
+        min_size_ls = LabeledScale(self._main_frame, 'Min face size:', 0, 1000, self.__min_size)
+        min_size_ls.set(0)
+        min_size_ls.grid(row=5, column=0, sticky=(W, E), pady=10)
+
+        self.__max_size = IntVar()
+        max_size_ls = LabeledScale(self._main_frame, 'Max face size:', 0, 4000, self.__max_size)
+        max_size_ls.set(0)
+        max_size_ls.grid(row=6, column=0, sticky=(W, E), pady=10)
+
+        # empty region means the whole image
+        self.__region = StringVar()
+        region_label = ttk.Label(self._main_frame, text='Search region (x y w h):', anchor='w')
+        region_label.grid(row=7, column=0, sticky=W)
+        region_entry = ttk.Entry(self._main_frame, textvariable=self.__region)
+        region_entry.grid(row=8, column=0, sticky=(W, E), pady=(0, 10))
+
+    def __parse_region(self):
+        text = self.__region.get().replace(',', ' ').split()
+        if not text:
+            return None
+        try:
+            region = tuple(int(value) for value in text)
+        except ValueError:
+            region = ()
+        if len(region) != 4 or region[2] <= 0 or region[3] <= 0:
+            raise ValueError('Search region must be given as four integers: x y width height')
+        return region
+
+    def __apply(self):
+        try:
+            region = self.__parse_region()
+        except ValueError as error:
+            messagebox.showerror('Invalid region', str(error))
+            return
+        self._callback_function(getdouble(self.__scale_factor.get()), self.__min_neighbours.get(),
+                                self.__thickness.get(), self._color_to_bgr[self.__color.get()],
+                                self.__working_scale.get(), self.__min_size.get(), self.__max_size.get(), region)
+
     @property
     def callback(self):
         return self._callback_function
@@ -360,10 +455,7 @@ class HaarCascadeMenu(FaceDetectionMenu):
     @callback.setter
     def callback(self, callback_function):
         self._callback_function = callback_function
-        self._button.configure(command=lambda: self._callback_function(getdouble(self.__scale_factor.get()),
-                                                                       self.__min_neighbours.get(),
-                                                                       self.__thickness.get(),
-                                                                       self._color_to_bgr[self.__color.get()]))
+        self._button.configure(command=self.__apply)
 
 
 class ShapePredictorMenu(FaceDetectionMenu):
@@ -415,3 +507,117 @@ class ShapePredictorMenu(FaceDetectionMenu):
                                                                        self._color_to_bgr[self.__face_color.get()],
                                                                        self._color_to_bgr[self.__frame_color.get()],
                                                                        self.__thickness.get()))
+
+
+class SweepDialog(Toplevel):
+    # lets user pick one or two parameters with ranges of values, on_accept gets {name: (start, stop, steps)}
+    def __init__(self, master, parameters, names, on_accept, **kw):
+        super().__init__(master, **kw)
+        self.title('Parameter sweep')
+        self.resizable(False, False)
+        self.__parameters = parameters
+        self.__on_accept = on_accept
+        self.__rows = []
+
+        ttk.Label(self, text='Parameter').grid(row=0, column=0, padx=5, pady=5)
+        ttk.Label(self, text='From').grid(row=0, column=1, padx=5, pady=5)
+        ttk.Label(self, text='To').grid(row=0, column=2, padx=5, pady=5)
+        ttk.Label(self, text='Steps').grid(row=0, column=3, padx=5, pady=5)
+
+        for row in range(2):
+            name = StringVar(value=names[0] if row == 0 and names else '')
+            start = StringVar()
+            stop = StringVar()
+            steps = StringVar(value='5')
+            combobox = ttk.Combobox(self, textvariable=name, values=[''] + names, state='readonly', width=12)
+            combobox.grid(row=row + 1, column=0, padx=5, pady=2)
+            ttk.Entry(self, textvariable=start, width=8).grid(row=row + 1, column=1, padx=5, pady=2)
+            ttk.Entry(self, textvariable=stop, width=8).grid(row=row + 1, column=2, padx=5, pady=2)
+            ttk.Spinbox(self, textvariable=steps, from_=1, to=8, width=4).grid(row=row + 1, column=3, padx=5, pady=2)
+            name.trace_add('write', lambda *args, row_variables=(name, start, stop): self.__fill_range(*row_variables))
+            self.__fill_range(name, start, stop)
+            self.__rows.append((name, start, stop, steps))
+
+        ttk.Button(self, text='Sweep', command=self.__accept).grid(row=3, column=0, columnspan=4, sticky=(W, E),
+                                                                   padx=5, pady=10)
+        self.transient(master)
+
+    def __fill_range(self, name, start, stop):
+        # default range goes around the current value
+        value = self.__parameters.get(name.get())
+        if value is None:
+            start.set('')
+            stop.set('')
+        else:
+            start.set(value / 2 if isinstance(value, float) else value // 2)
+            stop.set(value * 2)
+
+    def __accept(self):
+        ranges = {}
+        try:
+            for name, start, stop, steps in self.__rows:
+                if name.get() != '':
+                    ranges[name.get()] = (getdouble(start.get()), getdouble(stop.get()), int(steps.get()))
+        except (ValueError, TclError):
+            messagebox.showerror(title='Error', message='Ranges must be numbers', parent=self)
+            return
+        if not ranges:
+            messagebox.showerror(title='Error', message='Choose at least one parameter', parent=self)
+            return
+        self.destroy()
+        self.__on_accept(ranges)
+
+
+class ExportDialog(Toplevel):
+    # lets user pick history steps and encoder options, on_accept gets
+    # (indices, directory, extension, png compression, jpeg quality)
+    def __init__(self, master, descriptions, png_compression, jpeg_quality, on_accept, **kw):
+        super().__init__(master, **kw)
+        self.title('Export history')
+        self.resizable(False, False)
+        self.__on_accept = on_accept
+        self.__extension = StringVar(value='.png')
+        self.__png_compression = StringVar(value=str(png_compression))
+        self.__jpeg_quality = StringVar(value=str(jpeg_quality))
+
+        ttk.Label(self, text='Steps').grid(row=0, column=0, columnspan=2, sticky=W, padx=5, pady=5)
+        self.__steps = Listbox(self, selectmode=EXTENDED, exportselection=False, height=min(len(descriptions), 12),
+                               width=40)
+        self.__steps.insert(END, *descriptions)
+        self.__steps.selection_set(0, END)
+        self.__steps.grid(row=1, column=0, columnspan=2, padx=5, pady=2)
+
+        ttk.Label(self, text='Format').grid(row=2, column=0, sticky=W, padx=5, pady=2)
+        ttk.Combobox(self, textvariable=self.__extension, values=['.png', '.jpg'], state='readonly',
+                     width=6).grid(row=2, column=1, sticky=W, padx=5, pady=2)
+        ttk.Label(self, text='PNG compression').grid(row=3, column=0, sticky=W, padx=5, pady=2)
+        ttk.Spinbox(self, textvariable=self.__png_compression, from_=0, to=9,
+                    width=4).grid(row=3, column=1, sticky=W, padx=5, pady=2)
+        ttk.Label(self, text='JPEG quality').grid(row=4, column=0, sticky=W, padx=5, pady=2)
+        ttk.Spinbox(self, textvariable=self.__jpeg_quality, from_=0, to=100,
+                    width=4).grid(row=4, column=1, sticky=W, padx=5, pady=2)
+
+        ttk.Button(self, text='Export', command=self.__accept).grid(row=5, column=0, columnspan=2, sticky=(W, E),
+                                                                    padx=5, pady=10)
+        self.transient(master)
+
+    def __accept(self):
+        try:
+            png_compression = int(self.__png_compression.get())
+            jpeg_quality = int(self.__jpeg_quality.get())
+        except ValueError:
+            messagebox.showerror(title='Error', message='Options must be integers', parent=self)
+            return
+        if not 0 <= png_compression <= 9 or not 0 <= jpeg_quality <= 100:
+            messagebox.showerror(title='Error', message='PNG compression must be in 0-9 and JPEG quality in 0-100',
+                                 parent=self)
+            return
+        indices = list(self.__steps.curselection())
+        if not indices:
+            messagebox.showerror(title='Error', message='Choose at least one step', parent=self)
+            return
+        directory = fd.askdirectory(title='Export to...', parent=self)
+        if not directory:
+            return
+        self.destroy()
+        self.__on_accept(indices, directory, self.__extension.get(), png_compression, jpeg_quality)
@@ -0,0 +1,38 @@
+import json
+import operations
+
+
+# Pipeline is a list of steps, each step is (operation name, parameters dict). Operation names are the same as names
+# of ImageManager methods, so a pipeline can be recorded in the application and replayed without it.
+
+def steps_from_records(records):
+    return [(record.operation, record.parameters) for record in records if record.operation is not None]
+
+
+def save_pipeline(path, steps):
+    with open(path, 'w') as file:
+        json.dump({'steps': [{'operation': name, 'parameters': parameters} for name, parameters in steps]}, file,
+                  indent=4)
+
+
+def load_pipeline(path):
+    with open(path) as file:
+        data = json.load(file)
+    steps = []
+    for step in data['steps']:
+        name = step['operation']
+        if name not in operations.OPERATIONS:
+            raise ValueError(f'Unknown operation: {name}')
+        steps.append((name, step.get('parameters', {})))
+    return steps
+
+
+def run_pipeline(image, steps, is_grayscale=False):
+    for name, parameters in steps:
+        operation = operations.OPERATIONS[name]
+        success, error_message = operation.validate(is_grayscale)
+        if not success:
+            raise ValueError(f'{name}: {error_message}')
+        image = operation(image, **parameters)
+        is_grayscale = operation.result_grayscale(is_grayscale)
+    return image, is_grayscale
@@ -0,0 +1,52 @@
+import queue
+import threading
+
+
+class PreviewWorker:
+    # Runs preview jobs on a background thread. Only the newest job matters: submitting a job replaces the one that
+    # waits for execution and results of older jobs are dropped.
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__pending = None
+        self.__generation = 0
+        self.__results = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def submit(self, job):
+        with self.__condition:
+            self.__generation += 1
+            self.__pending = (self.__generation, job)
+            self.__condition.notify()
+
+    def cancel(self):
+        with self.__condition:
+            self.__generation += 1
+            self.__pending = None
+
+    def poll(self):
+        # returns (True, result) of the newest job or (False, None) when there is nothing new;
+        # result is an exception instance if the job failed
+        newest = (False, None)
+        while True:
+            try:
+                generation, result = self.__results.get_nowait()
+            except queue.Empty:
+                return newest
+            if generation == self.__generation:
+                newest = (True, result)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while self.__pending is None:
+                    self.__condition.wait()
+                generation, job = self.__pending
+                self.__pending = None
+            try:
+                result = job()
+            except Exception as error:
+                result = error
+            with self.__condition:
+                if generation == self.__generation:
+                    self.__results.put((generation, result))
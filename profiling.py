@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Profiler:
+    # Measures wall time of nested stages. Breakdown of the last finished top-level stage is always kept (it's cheap),
+    # rolling log of all stages is recorded only when recording is enabled and can be exported as Chrome trace
+    # (chrome://tracing or https://ui.perfetto.dev).
+    def __init__(self, max_events=100000, recording=False):
+        self.recording = recording
+        self.__events = deque(maxlen=max_events)
+        self.__local = threading.local()
+        self.__last_breakdown = []
+        self.__origin = time.perf_counter()
+
+    @property
+    def last_breakdown(self):
+        # list of (stage name, seconds), top-level stage goes last
+        return self.__last_breakdown
+
+    @contextmanager
+    def stage(self, name):
+        local = self.__local
+        if not hasattr(local, 'depth'):
+            local.depth = 0
+            local.breakdown = []
+        if local.depth == 0:
+            local.breakdown = []
+        local.depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            local.depth -= 1
+            local.breakdown.append((name, end - start))
+            if local.depth == 0:
+                self.__last_breakdown = local.breakdown
+            if self.recording:
+                self.__events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                      'ts': (start - self.__origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    def format_breakdown(self):
+        return ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in self.__last_breakdown)
+
+    def clear(self):
+        self.__events.clear()
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': list(self.__events), 'displayTimeUnit': 'ms'}, file)
+
+
+# shared by the whole application, recording can be enabled at start with IMAGE_TESTER_TRACE=1
+profiler = Profiler(recording=os.environ.get('IMAGE_TESTER_TRACE') == '1')
@@ -0,0 +1,28 @@
+import cv2
+
+# levels smaller than this (in pixels on the shorter side) are not built
+MIN_LEVEL_SIZE = 16
+
+
+class Pyramid:
+    # Image with power-of-two downscaled levels built with cv2.pyrDown when they are needed for the first time. Any
+    # scale is resampled from the nearest level which is not smaller, so downscaling costs about the same at every
+    # scale and does not alias like a single large resize.
+    def __init__(self, image):
+        self.image = image
+        self.__levels = [image]
+
+    @property
+    def memory_usage(self):
+        return sum(level.nbytes for level in self.__levels[1:])
+
+    def level(self, scale):
+        # returns (level image, scale in percents which has to be applied to it) for scale of the original image
+        ratio = 100 / scale
+        index = 0
+        while 2 ** (index + 1) <= ratio and min(self.image.shape[:2]) >> (index + 1) >= MIN_LEVEL_SIZE:
+            index += 1
+        while len(self.__levels) <= index:
+            self.__levels.append(cv2.pyrDown(self.__levels[-1]))
+        level = self.__levels[index]
+        return level, scale * self.image.shape[1] / level.shape[1]
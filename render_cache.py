@@ -0,0 +1,37 @@
+from collections import OrderedDict
+
+
+class RenderCache:
+    # LRU cache of images rendered for display. Keys are tuples starting with history index of the rendered entry,
+    # so all renders of one entry can be dropped when the entry changes.
+    def __init__(self, max_entries=16, max_bytes=256 * 1024 * 1024):
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        self.__entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, size=0):
+        if key in self.__entries:
+            self.__bytes -= self.__entries.pop(key)[1]
+        self.__entries[key] = (value, size)
+        self.__bytes += size
+        while len(self.__entries) > 1 and (len(self.__entries) > self.__max_entries or self.__bytes > self.__max_bytes):
+            self.__bytes -= self.__entries.popitem(last=False)[1][1]
+
+    def invalidate(self, index):
+        for key in [key for key in self.__entries if key[0] == index]:
+            self.__bytes -= self.__entries.pop(key)[1]
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import weakref
+import zipfile
+import numpy as np
+import operations
+from history import History, HistoryRecord, DEFAULT_MEMORY_BUDGET
+
+# Session is a zip archive with index.json (records of all history steps) and one deflated .npy member per stored
+# image (keyframes and the newest step), so single images can be read without decompressing the others.
+SESSION_VERSION = 1
+INDEX_NAME = 'index.json'
+# fastest deflate level, higher levels take several times longer and make images only slightly smaller
+COMPRESSION_LEVEL = 1
+
+
+def entry_name(index):
+    return f'entries/{index:05d}.npy'
+
+
+def save_session(path, history):
+    keyframes = list(history.keyframes)
+    top = len(history) - 1
+    stored = keyframes if keyframes[-1] == top else keyframes + [top]
+    index = {
+        'version': SESSION_VERSION,
+        'records': [{'operation': record.operation, 'parameters': record.parameters,
+                     'is_grayscale': record.is_grayscale} for record in history.records],
+        'keyframes': keyframes,
+        'entries': [],
+    }
+    # session is written next to the old one and replaces it at the end, so it can still be read in the meantime
+    file_descriptor, temporary_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(file_descriptor)
+    try:
+        with zipfile.ZipFile(temporary_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESSION_LEVEL) as archive:
+            for i in stored:
+                image = np.ascontiguousarray(history[i][0])
+                with archive.open(entry_name(i), 'w', force_zip64=True) as file:
+                    np.lib.format.write_array(file, image, allow_pickle=False)
+                index['entries'].append({'index': i, 'shape': list(image.shape), 'dtype': image.dtype.str})
+            archive.writestr(INDEX_NAME, json.dumps(index))
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def load_session(path, memory_budget=DEFAULT_MEMORY_BUDGET):
+    # returns History, only the index and the newest image are read at once, other images on first access
+    archive = zipfile.ZipFile(path)
+    try:
+        index = json.loads(archive.read(INDEX_NAME))
+        if index.get('version') != SESSION_VERSION:
+            raise ValueError(f'Unsupported session version: {index.get("version")}')
+        records = []
+        for record in index['records']:
+            if record['operation'] is not None and record['operation'] not in operations.OPERATIONS:
+                raise ValueError(f'Unknown operation: {record["operation"]}')
+            records.append(HistoryRecord(record['operation'], record['parameters'], record['is_grayscale']))
+
+        def reader(name):
+            def read():
+                with archive.open(name) as file:
+                    return np.lib.format.read_array(file, allow_pickle=False)
+            return read
+
+        history = History(memory_budget)
+        history.restore(records, [(entry['index'], reader(entry_name(entry['index'])), tuple(entry['shape']),
+                                   np.dtype(entry['dtype'])) for entry in index['entries']], index['keyframes'])
+        # the newest image is displayed at once, so it is read now
+        history[-1]
+    except BaseException:
+        archive.close()
+        raise
+    # archive stays open while any image may still be read from it
+    weakref.finalize(history, archive.close)
+    return history
@@ -0,0 +1,77 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import operations
+
+MAX_COMBINATIONS = 64
+THUMBNAIL_SIZE = 160
+
+
+def sweep_values(start, stop, steps, integer=True, odd=False):
+    values = np.linspace(start, stop, max(steps, 1))
+    if not integer:
+        return [round(float(value), 2) for value in values]
+    values = [int(round(value)) for value in values]
+    if odd:
+        values = [value if value % 2 == 1 else value + 1 for value in values]
+    # rounding may produce the same value more than once
+    return list(dict.fromkeys(values))
+
+
+def thumbnail(image, is_grayscale, size=THUMBNAIL_SIZE):
+    factor = size / max(image.shape[0], image.shape[1])
+    if factor < 1:
+        image = cv2.resize(image, (max(int(image.shape[1] * factor), 1), max(int(image.shape[0] * factor), 1)),
+                           interpolation=cv2.INTER_AREA)
+    if not is_grayscale:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+
+class Sweep:
+    # Computes operation for every combination of swept parameter values on a pool of threads (opencv releases GIL,
+    # so threads run in parallel and the image does not have to be copied to other processes).
+    def __init__(self, image, is_grayscale, operation_name, base_parameters, values, workers=None):
+        operation = operations.OPERATIONS[operation_name]
+        names = list(values)
+        # (number of values of the first parameter, number of values of the second one)
+        self.shape = (len(values[names[0]]), len(values[names[1]]) if len(names) > 1 else 1)
+        self.combinations = [dict(base_parameters, **dict(zip(names, combination)))
+                             for combination in itertools.product(*values.values())]
+        self.swept_parameters = names
+        result_grayscale = operation.result_grayscale(is_grayscale)
+
+        def compute(parameters):
+            return thumbnail(operation(image, **parameters), result_grayscale)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        self.__futures = [executor.submit(compute, parameters) for parameters in self.combinations]
+        executor.shutdown(wait=False)
+        self.__reported = set()
+
+    def __len__(self):
+        return len(self.combinations)
+
+    def label(self, index):
+        return ' '.join(f'{name}={self.combinations[index][name]}' for name in self.swept_parameters)
+
+    def poll(self):
+        # returns list of (index, thumbnail) completed since the last poll, thumbnail is an exception on failure
+        completed = []
+        for index, future in enumerate(self.__futures):
+            if index not in self.__reported and future.done():
+                self.__reported.add(index)
+                if future.cancelled():
+                    continue
+                error = future.exception()
+                completed.append((index, error if error is not None else future.result()))
+        return completed
+
+    @property
+    def finished(self):
+        return len(self.__reported) == len(self.__futures)
+
+    def cancel(self):
+        for future in self.__futures:
+            future.cancel()
@@ -0,0 +1,220 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import operations
+from pipeline import load_pipeline
+
+DEFAULT_TILE_SIZE = 1024
+# size of the corner of the image used to find out shape and type of the result
+PROBE_SIZE = 32
+
+
+# Images bigger than memory are kept in memory-mapped .npy files and processed tile by tile on a pool of threads
+# (opencv releases GIL). Every tile is read together with a halo of neighbouring pixels which its kernel needs, so
+# only (tile size + 2 * halo) ^ 2 pixels per worker are in memory and the result is the same as for the whole image.
+# Operations which are not tileable (Canny) are applied to the whole image at once, so they need memory for it.
+
+def _rotate_by_90_region(shape, y0, y1, x0, x1):
+    return shape[0] - x1, shape[0] - x0, y0, y1
+
+
+def _rotate_by_180_region(shape, y0, y1, x0, x1):
+    return shape[0] - y1, shape[0] - y0, shape[1] - x1, shape[1] - x0
+
+
+def _rotate_by_270_region(shape, y0, y1, x0, x1):
+    return x0, x1, shape[1] - y1, shape[1] - y0
+
+
+# rotations move pixels across the image, they map region of the result to the region of the source
+SOURCE_REGIONS = {
+    'rotate_by_90': _rotate_by_90_region,
+    'rotate_by_180': _rotate_by_180_region,
+    'rotate_by_270': _rotate_by_270_region,
+}
+
+
+def tile_regions(height, width, tile_size=DEFAULT_TILE_SIZE):
+    return [(y, min(y + tile_size, height), x, min(x + tile_size, width))
+            for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+
+def open_source(path):
+    # .npy files are memory mapped, other images are decoded (this needs memory for the whole image once) and
+    # stored next to the output as memory-mapped array; returns (array, is grayscale)
+    if path.lower().endswith('.npy'):
+        image = np.load(path, mmap_mode='r')
+    else:
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f'Could not read {path}')
+        if image.ndim == 3 and image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image, image.ndim == 2
+
+
+def result_layout(operation, name, parameters, source):
+    # returns (shape, dtype) of the result of operation on the whole source
+    height, width = source.shape[:2]
+    if name in SOURCE_REGIONS and name != 'rotate_by_180':
+        height, width = width, height
+    probe = operation(np.ascontiguousarray(source[:PROBE_SIZE, :PROBE_SIZE]), **parameters)
+    return (height, width) + probe.shape[2:], probe.dtype
+
+
+def apply_tiled(operation, name, parameters, source, output, tile_size=DEFAULT_TILE_SIZE, workers=None,
+                progress=None):
+    height, width = output.shape[:2]
+    if not operation.tileable:
+        output[...] = operation(np.asarray(source), **parameters)
+        if progress is not None:
+            progress(1, 1)
+        return
+    halo = operation.halo_size(parameters)
+    source_region = SOURCE_REGIONS.get(name)
+
+    def process(region):
+        y0, y1, x0, x1 = region
+        if source_region is not None:
+            sy0, sy1, sx0, sx1 = source_region(source.shape, y0, y1, x0, x1)
+            output[y0:y1, x0:x1] = operation(np.ascontiguousarray(source[sy0:sy1, sx0:sx1]), **parameters)
+            return
+        hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, height)
+        hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, width)
+        result = operation(np.ascontiguousarray(source[hy0:hy1, hx0:hx1]), **parameters)
+        output[y0:y1, x0:x1] = result[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+    regions = tile_regions(height, width, tile_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for done, _ in enumerate(executor.map(process, regions), 1):
+            if progress is not None:
+                progress(done, len(regions))
+
+
+def run_tiled_pipeline(source, steps, output_path, is_grayscale=False, tile_size=DEFAULT_TILE_SIZE, workers=None,
+                       progress=None):
+    # Applies steps one after another, intermediate results are memory-mapped temporary files. The result is
+    # memory-mapped .npy file at output_path; returns (result, is grayscale). progress is called with
+    # (step, number of steps, done tiles, number of tiles).
+    for name, parameters in steps:
+        operation = operations.OPERATIONS[name]
+        success, error_message = operation.validate(is_grayscale)
+        if not success:
+            raise ValueError(f'{name}: {error_message}')
+        is_grayscale = operation.result_grayscale(is_grayscale)
+
+    work_dir = tempfile.mkdtemp(prefix='image_tester_tiled_', dir=os.path.dirname(os.path.abspath(output_path)))
+    current = source
+    try:
+        if not steps:
+            current = np.lib.format.open_memmap(output_path, 'w+', source.dtype, source.shape)
+            for y0, y1, x0, x1 in tile_regions(*source.shape[:2], tile_size):
+                current[y0:y1, x0:x1] = source[y0:y1, x0:x1]
+        for index, (name, parameters) in enumerate(steps):
+            operation = operations.OPERATIONS[name]
+            shape, dtype = result_layout(operation, name, parameters, current)
+            path = output_path if index == len(steps) - 1 else os.path.join(work_dir, f'{index}.npy')
+            output = np.lib.format.open_memmap(path, 'w+', dtype, shape)
+
+            def step_progress(done, total, step=index):
+                if progress is not None:
+                    progress(step, len(steps), done, total)
+            apply_tiled(operation, name, parameters, current, output, tile_size, workers, step_progress)
+            output.flush()
+            previous, current = current, output
+            if previous is not source:
+                # the file of previous step can be removed when its mapping is closed
+                previous_path = previous.filename
+                del previous
+                os.remove(previous_path)
+    finally:
+        for name in os.listdir(work_dir):
+            try:
+                os.remove(os.path.join(work_dir, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(work_dir)
+        except OSError:
+            pass
+    return current, is_grayscale
+
+
+def save_result(result, path):
+    # .npy results are already stored at the output path, other formats have to be encoded from the whole image
+    if not path.lower().endswith('.npy'):
+        if not cv2.imwrite(path, result):
+            raise ValueError(f'Could not write {path}')
+
+
+class TiledJob:
+    # runs tiled pipeline from input file to output file on a background thread
+    def __init__(self, steps, input_path, output_path, tile_size=DEFAULT_TILE_SIZE, workers=None):
+        self.__steps = steps
+        self.__input_path = input_path
+        self.__output_path = output_path
+        self.__tile_size = tile_size
+        self.__workers = workers
+        # (step, number of steps, done tiles, number of tiles)
+        self.progress = (0, max(len(steps), 1), 0, 0)
+        self.error = None
+        self.finished = False
+        self.duration = None
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def __set_progress(self, step, steps_count, done, total):
+        self.progress = (step, steps_count, done, total)
+
+    def __run(self):
+        start = time.perf_counter()
+        npy_output = self.__output_path if self.__output_path.lower().endswith('.npy') else self.__output_path + '.npy'
+        try:
+            source, is_grayscale = open_source(self.__input_path)
+            result, is_grayscale = run_tiled_pipeline(source, self.__steps, npy_output, is_grayscale,
+                                                      self.__tile_size, self.__workers, self.__set_progress)
+            save_result(result, self.__output_path)
+            del result
+            if npy_output != self.__output_path:
+                os.remove(npy_output)
+        except Exception as error:
+            self.error = error
+        self.duration = time.perf_counter() - start
+        self.finished = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply pipeline to an image bigger than memory tile by tile')
+    parser.add_argument('pipeline', help='pipeline file exported from the application (File > Export Pipeline)')
+    parser.add_argument('input', help='image or memory-mappable .npy file')
+    parser.add_argument('output', help='.npy file (memory mapped) or image')
+    parser.add_argument('-t', '--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker threads')
+    args = parser.parse_args()
+
+    source, is_grayscale = open_source(args.input)
+    steps = load_pipeline(args.pipeline)
+    for name, _ in steps:
+        if not operations.OPERATIONS[name].tileable:
+            print(f'Warning: {name} can not be computed in tiles, it needs memory for the whole image')
+    npy_output = args.output if args.output.lower().endswith('.npy') else args.output + '.npy'
+
+    def progress(step, steps_count, done, total):
+        print(f'\rstep {step + 1}/{steps_count}: {done}/{total} tiles', end='', flush=True)
+
+    start = time.perf_counter()
+    result, is_grayscale = run_tiled_pipeline(source, steps, npy_output, is_grayscale, args.tile_size, args.workers,
+                                              progress)
+    save_result(result, args.output)
+    print(f'\nProcessed {source.shape[1]}x{source.shape[0]} image in {time.perf_counter() - start:.2f} s')
+    if npy_output != args.output:
+        del result
+        os.remove(npy_output)
+
+
+if __name__ == '__main__':
+    main()
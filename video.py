@@ -0,0 +1,198 @@
+import argparse
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+import face_detection
+from pipeline import load_pipeline, run_pipeline
+
+DEFAULT_DISPLAY_FPS = 25
+# number of the last frames used to compute latency statistics
+LATENCY_WINDOW = 200
+
+
+def read_frames(path, should_skip=None):
+    # Yields (frame index, frame) read from a video file one by one. Frames for which should_skip() returns True are
+    # only grabbed from the stream without decoding, which is much cheaper than reading them.
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f'Could not open video {path}')
+    try:
+        index = 0
+        while True:
+            if should_skip is not None and should_skip(index):
+                if not capture.grab():
+                    return
+            else:
+                success, frame = capture.read()
+                if not success:
+                    return
+                yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def video_properties(path):
+    # returns (frames per second, number of frames, (width, height)), fps and number of frames may be 0 if unknown
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise IOError(f'Could not open video {path}')
+    properties = (capture.get(cv2.CAP_PROP_FPS), int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+                  (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+    capture.release()
+    return properties
+
+
+def haar_detector(cascade, scale_factor=1.1, min_neighbours=10, working_scale=50):
+    def detect(gray_frame):
+        return face_detection.haar_detect(cascade, gray_frame, scale_factor, min_neighbours, working_scale)
+    return detect
+
+
+def process_frame(frame, steps, detector=None):
+    # returns BGR frame after pipeline with detected faces drawn on it
+    image, is_grayscale = run_pipeline(frame, steps)
+    result = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR) if is_grayscale else image
+    if detector is not None:
+        faces = detector(image if is_grayscale else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        if len(faces):
+            if result is frame:
+                result = result.copy()
+            face_detection.draw_haar_faces(result, faces)
+    return result
+
+
+class VideoProcessor:
+    # Processes video on a background thread. When nothing is written to a file and processing is slower than the
+    # video, frames are skipped to keep up with it. Only the newest processed frame is kept for display, so a slow
+    # display never stops processing (results replaced before they were taken are counted as dropped).
+    def __init__(self, path, steps, detector=None, output_path=None, drop_frames=True):
+        self.__path = path
+        self.__steps = steps
+        self.detector = detector
+        self.__fps, self.__frame_count, _ = video_properties(path)
+        self.__output_path = output_path
+        self.__drop_frames = drop_frames and output_path is None and self.__fps > 0
+
+        self.__lock = threading.Lock()
+        self.__latest = None
+        self.__processed = 0
+        self.__skipped = 0
+        self.__display_dropped = 0
+        self.__latencies = deque(maxlen=LATENCY_WINDOW)
+        self.__start = None
+        self.__end = None
+        self.__stopped = False
+        self.error = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+
+    @property
+    def fps(self):
+        return self.__fps
+
+    @property
+    def frame_count(self):
+        return self.__frame_count
+
+    @property
+    def finished(self):
+        return self.__end is not None
+
+    def start(self):
+        self.__start = time.perf_counter()
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped = True
+
+    def join(self):
+        self.__thread.join()
+
+    def take(self):
+        # returns the newest processed frame (BGR) or None if there is no new one since the last call
+        with self.__lock:
+            frame, self.__latest = self.__latest, None
+        return frame
+
+    def statistics(self):
+        with self.__lock:
+            latencies = np.array(self.__latencies)
+            processed = self.__processed
+            skipped = self.__skipped
+            display_dropped = self.__display_dropped
+        elapsed = (self.__end or time.perf_counter()) - self.__start if self.__start is not None else 0
+        return {
+            'processed': processed,
+            'skipped': skipped,
+            'display_dropped': display_dropped,
+            'fps': processed / elapsed if elapsed > 0 else 0.0,
+            'latency_p50_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else 0.0,
+            'latency_p95_ms': float(np.percentile(latencies, 95) * 1000) if len(latencies) else 0.0,
+        }
+
+    def __behind(self, index):
+        # frame is late when the time it should be shown at has already passed
+        late = index / self.__fps < time.perf_counter() - self.__start
+        if late:
+            with self.__lock:
+                self.__skipped += 1
+        return late
+
+    def __run(self):
+        writer = None
+        try:
+            for index, frame in read_frames(self.__path, self.__behind if self.__drop_frames else None):
+                if self.__stopped:
+                    break
+                start = time.perf_counter()
+                result = process_frame(frame, self.__steps, self.detector)
+                if self.__output_path is not None:
+                    if writer is None:
+                        writer = cv2.VideoWriter(self.__output_path, cv2.VideoWriter_fourcc(*'mp4v'),
+                                                 self.__fps or DEFAULT_DISPLAY_FPS, (result.shape[1], result.shape[0]))
+                    writer.write(result)
+                with self.__lock:
+                    self.__latencies.append(time.perf_counter() - start)
+                    self.__processed += 1
+                    if self.__latest is not None:
+                        self.__display_dropped += 1
+                    self.__latest = result
+        except Exception as error:
+            self.error = error
+        finally:
+            if writer is not None:
+                writer.release()
+            self.__end = time.perf_counter()
+
+
+def format_statistics(statistics):
+    return (f'{statistics["processed"]} frames, {statistics["fps"]:.1f} fps, latency p50 '
+            f'{statistics["latency_p50_ms"]:.1f} ms, p95 {statistics["latency_p95_ms"]:.1f} ms, '
+            f'skipped {statistics["skipped"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply pipeline recorded in Image tester to every frame of a video')
+    parser.add_argument('pipeline', help='pipeline file exported from the application (File > Export Pipeline)')
+    parser.add_argument('input')
+    parser.add_argument('-o', '--output', help='write processed video to this file (.mp4)')
+    parser.add_argument('--haar', action='store_true', help='detect faces with haar cascade')
+    parser.add_argument('--working-scale', type=int, default=50, help='resolution (in percents) of face detection')
+    parser.add_argument('--realtime', action='store_true', help='skip frames when processing is slower than the video')
+    args = parser.parse_args()
+
+    detector = None
+    if args.haar:
+        detector = haar_detector(face_detection.load_haar_cascade(), working_scale=args.working_scale)
+    processor = VideoProcessor(args.input, load_pipeline(args.pipeline), detector, args.output, args.realtime)
+    processor.start()
+    processor.join()
+    if processor.error is not None:
+        raise processor.error
+    print(format_statistics(processor.statistics()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+from history import DEFAULT_MEMORY_BUDGET
+
+# inactive histories are moved to disk when their compressed images take more than this part of the budget
+INACTIVE_SHARE = 0.5
+
+
+class Document:
+    def __init__(self, name, history):
+        self.name = name
+        self.history = history
+
+
+class Workspace:
+    # Open images, each with its own History, sharing one memory budget. Only the active history keeps images in RAM,
+    # histories are compressed when they become inactive and when they still take too much memory, the least
+    # recently used ones are moved to disk. The active history gets what is left from the budget.
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.__memory_budget = memory_budget
+        self.__documents = []
+        # documents from the least to the most recently used
+        self.__recent = []
+        self.__active = None
+
+    @property
+    def names(self):
+        return [document.name for document in self.__documents]
+
+    @property
+    def active(self):
+        # index of the active document
+        return self.__documents.index(self.__active)
+
+    @property
+    def memory_usage(self):
+        return sum(document.history.memory_usage for document in self.__documents)
+
+    def __len__(self):
+        return len(self.__documents)
+
+    def add(self, name, history):
+        # new document becomes active, returns its index
+        self.__documents.append(Document(name, history))
+        self.activate(len(self.__documents) - 1)
+        return len(self.__documents) - 1
+
+    def close(self, index):
+        # returns history of document activated instead of closed one
+        if len(self.__documents) <= 1:
+            raise ValueError('The last image cannot be closed')
+        document = self.__documents.pop(index)
+        self.__recent.remove(document)
+        if document is self.__active:
+            self.__active = None
+            return self.activate(self.__documents.index(self.__recent[-1]))
+        return self.__active.history
+
+    def activate(self, index):
+        # returns history of the activated document
+        document = self.__documents[index]
+        if document is self.__active:
+            return document.history
+        if self.__active is not None:
+            self.__active.history.evict()
+        if document in self.__recent:
+            self.__recent.remove(document)
+        self.__recent.append(document)
+        self.__active = document
+
+        inactive = self.__recent[:-1]
+        inactive_usage = sum(other.history.memory_usage for other in inactive)
+        for other in inactive:
+            if inactive_usage <= self.__memory_budget * INACTIVE_SHARE:
+                break
+            inactive_usage -= other.history.memory_usage
+            other.history.evict(to_disk=True)
+        document.history.memory_budget = self.__memory_budget - inactive_usage
+        document.history.activate()
+        return document.history